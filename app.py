@@ -1,26 +1,144 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
 from dotenv import load_dotenv
-from pi_python import PiNetwork
-import os, traceback, time, requests
+from pi_python import PiNetwork, PiApiError, InvalidDestination, GMOP_ASSET_CODE, GMOP_ISSUER, GMOP_ASSET, NATIVE_ASSET
+from jobs import PayoutQueue, new_identifier
+from cache import TTLCache, MongoCacheStore, hash_key
+from payment_store import PaymentStore
+from confirmations import ConfirmationTracker
+from db import ensure_indexes
+import metrics
+import os, traceback, time, threading, math
 
 load_dotenv()
 
 app = Flask(__name__)
 CORS(app, origins=["https://chototpi.site"], supports_credentials=True)
 
-# 🔐 Khởi tạo SDK Pi A2U
+# 🔐 Khởi tạo SDK Pi A2U (chỉ parse key/cấu hình, không gọi Horizon → an toàn với preload_app)
 pi = PiNetwork()
 pi.initialize(
     api_key=os.getenv("PI_API_KEY"),
     wallet_private_key=os.getenv("APP_PRIVATE_KEY"),
-    env=os.getenv("PI_ENV", "testnet")
+    env=os.getenv("PI_ENV", "testnet"),
+    connect_timeout=float(os.getenv("PI_API_CONNECT_TIMEOUT", "3.05")),
+    read_timeout=float(os.getenv("PI_API_READ_TIMEOUT", "15")),
+    # Danh sách secret channel account, cách nhau bởi dấu phẩy
+    channel_secrets=[s.strip() for s in os.getenv("APP_CHANNEL_SECRETS", "").split(",") if s.strip()],
+    payment_store=PaymentStore(maxsize=int(os.getenv("PAYMENT_WORKING_SET", "1000"))),
+    # Ghi đè URL khi chạy với Horizon / Pi API giả lập
+    horizon_url=os.getenv("PI_HORIZON_URL"),
+    base_url=os.getenv("PI_API_BASE_URL"),
+    # ⛽ Phí theo percentile fee_stats, làm mới mỗi PI_FEE_REFRESH giây, trần PI_MAX_FEE stroops
+    fee_percentile=os.getenv("PI_FEE_PERCENTILE", "p70"),
+    max_fee=int(os.getenv("PI_MAX_FEE", "1000000")),
+    fee_refresh=float(os.getenv("PI_FEE_REFRESH", "30")),
+    # 🎯 Cache trạng thái ví nhận (tồn tại / trustline) cho kiểm tra trước khi ký
+    destination_ttl=int(os.getenv("PI_DESTINATION_CACHE_TTL", "300")),
+    # 🔒 Thư mục file lock sequence dùng chung giữa các worker (mặc định thư mục tạm)
+    sequence_lock_dir=os.getenv("PI_SEQUENCE_LOCK_DIR")
 )
 
+# 📡 PI_CONFIRM_STREAM=1: submit trả về ngay khi core nhận, complete khi stream Horizon thấy giao dịch
+if os.getenv("PI_CONFIRM_STREAM") == "1":
+    pi.confirmations = ConfirmationTracker(pi)
+
+# 🔥 Việc nền của mỗi worker: index Mongo, warm-up Horizon, stream xác nhận, reconcile
+_background_lock = threading.Lock()
+_background_pid = None
+
+def start_background():
+    """Chạy một lần mỗi process, sau fork (gunicorn post_worker_init hoặc request đầu tiên)."""
+    global _background_pid
+    if _background_pid == os.getpid():
+        return
+    with _background_lock:
+        if _background_pid == os.getpid():
+            return
+        _background_pid = os.getpid()
+
+    pi.start_warmup()
+    if pi.confirmations:
+        pi.confirmations.start()
+
+    threading.Thread(target=reconcile_loop, daemon=True).start()
+
+# 🔁 Payment dở dang (lần chạy trước, worker chết giữa chừng, job xếp hàng bị mất) → xử lý lại định kỳ
+RECONCILE_IDLE_SECONDS = int(os.getenv("PI_RECONCILE_IDLE", "300"))
+
+def reconcile_loop():
+    try:
+        ensure_indexes()
+    except Exception as e:
+        print(f"❌ Không tạo được index Mongo: {e}")
+    while True:
+        try:
+            pi.reconcile_payments(idle_seconds=RECONCILE_IDLE_SECONDS, resolve_wallet=get_user_wallet)
+        except Exception as e:
+            print(f"❌ Reconcile lỗi: {e}")
+        time.sleep(RECONCILE_IDLE_SECONDS)
+
+# 🗃️ Cache xác minh token & ví người dùng (lỗi 4xx cũng cache ngắn hạn)
+def is_client_error(e):
+    return isinstance(e, PiApiError) and 400 <= e.status_code < 500 and e.status_code != 429
+
+cache_store = MongoCacheStore() if os.getenv("PI_CACHE_MONGO") == "1" else None
+me_cache = TTLCache(ttl=int(os.getenv("PI_ME_CACHE_TTL", "300")), cache_error=is_client_error, store=cache_store)
+wallet_cache = TTLCache(ttl=int(os.getenv("PI_WALLET_CACHE_TTL", "3600")), cache_error=is_client_error, store=cache_store)
+
+def get_user_wallet(uid):
+    try:
+        return wallet_cache.get_or_load(
+            hash_key("wallet", uid),
+            lambda: pi.api.get_user(uid)["user"]["wallet"]["public_key"]
+        )
+    except PiApiError:
+        raise LookupError(f"❌ Không tìm thấy user UID: {uid}")
+
+# 🧵 Hàng đợi payout chạy nền
+payout_queue = PayoutQueue(pi, resolve_wallet=get_user_wallet, workers=int(os.getenv("A2U_WORKERS", "4")))
+
+MAX_BATCH_PAYOUTS = 1000
+# 🔥 Giới hạn mỗi lần rút GMOP (áp dụng cho /api/a2u-gmop và từng payout GMOP trong /api/a2u-batch)
+GMOP_MIN_AMOUNT, GMOP_MAX_AMOUNT = 1000, 10000
+
+def parse_amount(value):
+    """Số lượng hữu hạn > 0, None nếu thiếu / không phải số."""
+    try:
+        amount = float(value)
+    except (TypeError, ValueError):
+        return None
+    return amount if math.isfinite(amount) and amount > 0 else None
+
+# 📈 Đo thời gian mọi route
+@app.before_request
+def start_timer():
+    g.started_at = time.perf_counter()
+    # Chạy bằng `python app.py` / flask run thì không có hook gunicorn
+    start_background()
+
+@app.after_request
+def record_request(response):
+    if "started_at" in g:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.observe_request(route, request.method, response.status_code, time.perf_counter() - g.started_at)
+    return response
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE)
+
 @app.route("/", methods=["GET"])
 def home():
     return "✅ Pi A2U Python backend is running."
 
+# 🚦 Readiness: 200 khi đã load app account / base fee (warm-up nền xong), 503 khi chưa
+@app.route("/ready", methods=["GET"])
+def ready():
+    if pi.ready:
+        return jsonify({"ready": True, "account": pi.keypair.public_key})
+    return jsonify({"ready": False, "error": pi.warmup_error}), 503
+
 @app.route("/api/verify-user", methods=["POST"])
 def verify_user():
     try:
@@ -29,16 +147,16 @@ def verify_user():
         if not access_token:
             return jsonify({"error": "Thiếu accessToken"}), 400
 
-        headers = {"Authorization": f"Bearer {access_token}"}
         # 🧠 Luôn gọi xác minh qua mainnet
-        url = "https://api.minepi.com/v2/me"
-        response = requests.get(url, headers=headers)
-
-        if response.status_code != 200:
-            print("❌ Xác minh user thất bại:", response.text)
+        try:
+            user_data = me_cache.get_or_load(
+                hash_key("me", access_token),
+                lambda: pi.api.get_me(access_token)
+            )
+        except PiApiError as e:
+            print("❌ Xác minh user thất bại:", e.text)
             return jsonify({"error": "User không hợp lệ"}), 401
 
-        user_data = response.json()
         uid = user_data["uid"]
         print(f"✅ Xác minh UID: {uid}")
         return jsonify({"success": True, "user": user_data})
@@ -80,10 +198,14 @@ def a2u_direct():
 
         print(f"🧾 Yêu cầu A2U cho UID: {uid}, amount: {amount}, to_wallet: {to_wallet}")
 
-        if not to_wallet or not to_wallet.startswith("G"):
+        if not to_wallet:
             return jsonify({"success": False, "message": "❌ Địa chỉ ví không hợp lệ hoặc chưa được nhập."}), 400
+        try:
+            pi.check_destination(to_wallet)
+        except InvalidDestination as e:
+            return jsonify({"success": False, "message": str(e), "code": e.code}), 400
 
-        identifier = f"a2u-{uid[:6]}-{int(time.time())}"
+        identifier = new_identifier(uid)
         memo = "Chototpi thanh toán"
         payment_data = {
             "user_uid": uid,
@@ -97,8 +219,7 @@ def a2u_direct():
         }
 
         payment_id = pi.create_payment(payment_data)
-        txid = pi.submit_payment(payment_id, None)
-        pi.complete_payment(payment_id, txid)
+        txid = pi.pay(payment_id)
 
         return jsonify({"success": True, "txid": txid})
     except Exception as e:
@@ -118,21 +239,16 @@ def a2u_test():
         print(f"👤 Đang gửi A2U cho UID: {uid}, Amount: {amount}")
 
         # 🔎 B1: Gọi API mainnet để lấy ví người dùng
-        user_url = f"https://api.minepi.com/v2/users/{uid}"
-        user_res = requests.get(user_url, headers=pi.get_http_headers())
-        if user_res.status_code != 200:
-            print(f"❌ Không tìm thấy user UID: {uid}")
-            return jsonify({
-                "success": False,
-                "message": f"❌ Không tìm thấy user UID: {uid}"
-            }), 404
+        try:
+            user_wallet = get_user_wallet(uid)
+        except LookupError as e:
+            print(e)
+            return jsonify({"success": False, "message": str(e)}), 404
 
-        user_data = user_res.json()
-        user_wallet = user_data["user"]["wallet"]["public_key"]
         print(f"🎯 User Wallet Address: {user_wallet}")
 
         # 🧾 B2: Tạo identifier
-        identifier = f"a2u-{uid[:6]}-{int(time.time())}"
+        identifier = new_identifier(uid)
 
         # 🪙 B3: Chuẩn bị dữ liệu giao dịch
         payment_data = {
@@ -148,8 +264,7 @@ def a2u_test():
 
         # 🚀 B4: Gửi giao dịch testnet
         payment_id = pi.create_payment(payment_data)
-        txid = pi.submit_payment(payment_id, None)
-        pi.complete_payment(payment_id, txid)
+        txid = pi.pay(payment_id)
 
         print(f"✅ Đã gửi A2U thành công: {txid}")
         return jsonify({"success": True, "txid": txid, "to": user_wallet})
@@ -166,20 +281,24 @@ def a2u_gmop():
         to_wallet = data.get("to_wallet")
 
         # 🔥 Giới hạn rút GMOP
-        if amount < 1000 or amount > 10000:
+        if amount < GMOP_MIN_AMOUNT or amount > GMOP_MAX_AMOUNT:
             return jsonify({
                 "success": False,
-                "message": "Giới hạn mỗi lần rút là 1000 - 10000 GMOP."
+                "message": f"Giới hạn mỗi lần rút là {GMOP_MIN_AMOUNT} - {GMOP_MAX_AMOUNT} GMOP."
             }), 400
 
-        if not to_wallet or not to_wallet.startswith("G"):
+        if not to_wallet:
             return jsonify({"success": False, "message": "Ví testnet của bạn chưa bật tài sản GMOP không thể nhận token"}), 400
+        try:
+            pi.check_destination(to_wallet, GMOP_ASSET)
+        except InvalidDestination as e:
+            return jsonify({"success": False, "message": str(e), "code": e.code}), 400
 
         print(f"🔥 Đang gửi {amount} GMOP → {to_wallet}")
 
         txid = pi.send_token(
-            asset_code="GMOP",
-            asset_issuer="GDUIGY53ZJYDLFIJC43CGKABUJWJDAOC5JQMZWW2I7AVUDL5X5ZKXFM7",
+            asset_code=GMOP_ASSET_CODE,
+            asset_issuer=GMOP_ISSUER,
             amount=str(amount),
             destination=to_wallet
         )
@@ -189,3 +308,91 @@ def a2u_gmop():
     except Exception as e:
         traceback.print_exc()
         return jsonify({"success": False, "message": str(e)}), 500
+
+@app.route("/api/a2u-batch", methods=["POST"])
+def a2u_batch():
+    try:
+        data = request.get_json()
+        items = data.get("payouts") or []
+
+        if not items or len(items) > MAX_BATCH_PAYOUTS:
+            return jsonify({
+                "success": False,
+                "message": f"Số payout mỗi lần phải từ 1 - {MAX_BATCH_PAYOUTS}."
+            }), 400
+
+        payouts = []
+        for item in items:
+            to_wallet = item.get("to_wallet")
+            amount = parse_amount(item.get("amount"))
+            asset_code = str(item.get("asset", "PI")).upper()
+
+            if not to_wallet or not to_wallet.startswith("G"):
+                return jsonify({"success": False, "message": f"❌ Địa chỉ ví không hợp lệ: {to_wallet}"}), 400
+            if amount is None:
+                return jsonify({"success": False, "message": f"❌ Số lượng không hợp lệ: {item.get('amount')}"}), 400
+
+            if asset_code == "PI":
+                asset = NATIVE_ASSET
+            elif asset_code == GMOP_ASSET_CODE:
+                asset = GMOP_ASSET
+                if amount < GMOP_MIN_AMOUNT or amount > GMOP_MAX_AMOUNT:
+                    return jsonify({
+                        "success": False,
+                        "message": f"❌ Payout tới {to_wallet}: giới hạn mỗi lần rút là {GMOP_MIN_AMOUNT} - {GMOP_MAX_AMOUNT} GMOP."
+                    }), 400
+            else:
+                return jsonify({"success": False, "message": f"❌ Tài sản không hỗ trợ: {asset_code}"}), 400
+
+            payouts.append({
+                "to_wallet": to_wallet,
+                "amount": str(amount),
+                "asset_code": None if asset.is_native() else asset.code,
+                "asset_issuer": None if asset.is_native() else asset.issuer,
+                # Idempotency key: client gửi lại cùng "id" sau timeout không trả hai lần
+                "key": item.get("id")
+            })
+
+        # Lưu từng payout rồi trả về ngay; kết quả poll qua /api/a2u-jobs/<job_id>
+        jobs = payout_queue.enqueue_batch(payouts)
+        print(f"📦 Batch A2U: {len(jobs)} payout, {sum(duplicate for _, duplicate in jobs)} trùng key")
+        return jsonify({
+            "success": True,
+            "jobs": [
+                {"job_id": job_id, "to": item.get("to_wallet"), "duplicate": duplicate}
+                for item, (job_id, duplicate) in zip(items, jobs)
+            ]
+        }), 202
+
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"success": False, "message": str(e)}), 500
+
+@app.route("/api/a2u-queue", methods=["POST"])
+def a2u_queue():
+    try:
+        data = request.get_json()
+        uid = data.get("uid")
+        amount = str(data.get("amount"))
+        to_wallet = data.get("to_wallet")
+
+        if not uid:
+            return jsonify({"success": False, "message": "Thiếu uid"}), 400
+        # Không có to_wallet → worker tự lấy ví theo UID
+        if to_wallet and not to_wallet.startswith("G"):
+            return jsonify({"success": False, "message": "❌ Địa chỉ ví không hợp lệ."}), 400
+
+        job_id = payout_queue.enqueue(uid, amount, to_wallet)
+        print(f"🧵 Đã xếp hàng A2U job: {job_id}")
+        return jsonify({"success": True, "job_id": job_id}), 202
+
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"success": False, "message": str(e)}), 500
+
+@app.route("/api/a2u-jobs/<job_id>", methods=["GET"])
+def a2u_job_status(job_id):
+    job = payout_queue.status(job_id)
+    if not job:
+        return jsonify({"success": False, "message": "Không tìm thấy job"}), 404
+    return jsonify({"success": True, "job": job})
@@ -0,0 +1,235 @@
+# asgi.py — các route payout chạy async (hypercorn asgi:app)
+from quart import Quart, request, jsonify
+from quart_cors import cors
+from dotenv import load_dotenv
+from pi_python import PiApiError, InvalidDestination, GMOP_ASSET_CODE, GMOP_ISSUER, GMOP_ASSET
+from pi_python_async import AsyncPiNetwork
+from jobs import new_identifier
+from cache import TTLCache, MongoCacheStore, hash_key
+from payment_store import PaymentStore
+from db import ensure_indexes
+import asyncio, os, traceback
+
+load_dotenv()
+
+app = cors(Quart(__name__), allow_origin=["https://chototpi.site"], allow_credentials=True)
+
+pi = AsyncPiNetwork()
+
+# 🔁 Index Mongo, rồi xử lý lại payment dở dang định kỳ (cùng cấu hình với app.py)
+RECONCILE_IDLE_SECONDS = int(os.getenv("PI_RECONCILE_IDLE", "300"))
+_reconcile_task = None
+
+async def reconcile_loop():
+    await asyncio.to_thread(ensure_indexes)
+    while True:
+        try:
+            await pi.reconcile_payments(idle_seconds=RECONCILE_IDLE_SECONDS, resolve_wallet=get_user_wallet)
+        except Exception as e:
+            print(f"❌ Reconcile lỗi: {e}")
+        await asyncio.sleep(RECONCILE_IDLE_SECONDS)
+
+@app.before_serving
+async def init_pi():
+    # 🔐 Khởi tạo SDK Pi A2U trong event loop (load account / base fee chạy nền, xem /ready)
+    await pi.initialize(
+        api_key=os.getenv("PI_API_KEY"),
+        wallet_private_key=os.getenv("APP_PRIVATE_KEY"),
+        env=os.getenv("PI_ENV", "testnet"),
+        channel_secrets=[s.strip() for s in os.getenv("APP_CHANNEL_SECRETS", "").split(",") if s.strip()],
+        # Ghi xuyên xuống Mongo như app.py → crash giữa chừng vẫn reconcile được
+        payment_store=PaymentStore(maxsize=int(os.getenv("PAYMENT_WORKING_SET", "1000"))),
+        connect_timeout=float(os.getenv("PI_API_CONNECT_TIMEOUT", "3.05")),
+        read_timeout=float(os.getenv("PI_API_READ_TIMEOUT", "15")),
+        horizon_url=os.getenv("PI_HORIZON_URL"),
+        base_url=os.getenv("PI_API_BASE_URL"),
+        # ⛽ Phí theo percentile fee_stats (như app.py), fee-bump giao dịch chưa lên chain
+        fee_percentile=os.getenv("PI_FEE_PERCENTILE", "p70"),
+        max_fee=int(os.getenv("PI_MAX_FEE", "1000000")),
+        fee_refresh=float(os.getenv("PI_FEE_REFRESH", "30")),
+        destination_ttl=int(os.getenv("PI_DESTINATION_CACHE_TTL", "300")),
+        sequence_lock_dir=os.getenv("PI_SEQUENCE_LOCK_DIR")
+    )
+    global _reconcile_task
+    _reconcile_task = asyncio.create_task(reconcile_loop())
+
+# 🗃️ Cache xác minh token & ví người dùng, cùng cấu hình với app.py (lỗi 4xx cũng cache ngắn hạn)
+def is_client_error(e):
+    return isinstance(e, PiApiError) and 400 <= e.status_code < 500 and e.status_code != 429
+
+cache_store = MongoCacheStore() if os.getenv("PI_CACHE_MONGO") == "1" else None
+me_cache = TTLCache(ttl=int(os.getenv("PI_ME_CACHE_TTL", "300")), cache_error=is_client_error, store=cache_store)
+wallet_cache = TTLCache(ttl=int(os.getenv("PI_WALLET_CACHE_TTL", "3600")), cache_error=is_client_error, store=cache_store)
+
+async def get_user_wallet(uid):
+    async def load():
+        return (await pi.api.get_user(uid))["user"]["wallet"]["public_key"]
+
+    try:
+        return await wallet_cache.get_or_load_async(hash_key("wallet", uid), load)
+    except PiApiError:
+        raise LookupError(f"❌ Không tìm thấy user UID: {uid}")
+
+@app.after_serving
+async def close_pi():
+    if _reconcile_task is not None:
+        _reconcile_task.cancel()
+    await pi.close()
+
+@app.route("/", methods=["GET"])
+async def home():
+    return "✅ Pi A2U Python async backend is running."
+
+@app.route("/ready", methods=["GET"])
+async def ready():
+    if pi.ready:
+        return jsonify({"ready": True, "account": pi.keypair.public_key})
+    return jsonify({"ready": False, "error": pi.warmup_error}), 503
+
+@app.route("/api/verify-user", methods=["POST"])
+async def verify_user():
+    try:
+        data = await request.get_json()
+        access_token = data.get("accessToken")
+        if not access_token:
+            return jsonify({"error": "Thiếu accessToken"}), 400
+
+        try:
+            user_data = await me_cache.get_or_load_async(
+                hash_key("me", access_token),
+                lambda: pi.api.get_me(access_token)
+            )
+        except PiApiError as e:
+            print("❌ Xác minh user thất bại:", e.text)
+            return jsonify({"error": "User không hợp lệ"}), 401
+
+        print(f"✅ Xác minh UID: {user_data['uid']}")
+        return jsonify({"success": True, "user": user_data})
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/approve-payment", methods=["POST"])
+async def approve_payment():
+    try:
+        data = await request.get_json()
+        payment_id = data.get("paymentId")
+        print(f"🧾 Approve paymentId: {payment_id}")
+        result = await pi.approve_payment(payment_id)
+        return jsonify({"success": True, "approved": result})
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"success": False, "message": str(e)}), 500
+
+@app.route("/complete-payment", methods=["POST"])
+async def complete_payment():
+    try:
+        data = await request.get_json()
+        result = await pi.complete_payment(data.get("paymentId"), data.get("txid"))
+        return jsonify({"success": True, "txid": result})
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"success": False, "message": str(e)}), 500
+
+@app.route("/api/a2u-direct", methods=["POST"])
+async def a2u_direct():
+    try:
+        data = await request.get_json()
+        uid = data.get("uid")
+        amount = str(data.get("amount"))
+        to_wallet = data.get("to_wallet")
+
+        if not to_wallet:
+            return jsonify({"success": False, "message": "❌ Địa chỉ ví không hợp lệ hoặc chưa được nhập."}), 400
+        try:
+            await pi.check_destination(to_wallet)
+        except InvalidDestination as e:
+            return jsonify({"success": False, "message": str(e), "code": e.code}), 400
+
+        identifier = new_identifier(uid)
+        payment_data = {
+            "user_uid": uid,
+            "amount": amount,
+            "memo": "Chototpi thanh toán",
+            "metadata": {"source": "a2u"},
+            "identifier": identifier,
+            "from_address": pi.keypair.public_key,
+            "to_address": to_wallet,
+            "network": pi.network
+        }
+
+        payment_id = await pi.create_payment(payment_data)
+        txid = await pi.submit_payment(payment_id, None)
+        await pi.complete_payment(payment_id, txid)
+
+        return jsonify({"success": True, "txid": txid})
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"success": False, "message": str(e)}), 500
+
+@app.route("/api/a2u-test", methods=["POST"])
+async def a2u_test():
+    try:
+        data = await request.get_json()
+        uid = data.get("uid")
+        amount = str(data.get("amount"))
+        print(f"👤 Đang gửi A2U cho UID: {uid}, Amount: {amount}")
+
+        try:
+            user_wallet = await get_user_wallet(uid)
+        except LookupError as e:
+            print(e)
+            return jsonify({"success": False, "message": str(e)}), 404
+
+        identifier = new_identifier(uid)
+        payment_data = {
+            "user_uid": uid,
+            "amount": amount,
+            "memo": identifier,
+            "metadata": {"source": "a2u"},
+            "identifier": identifier,
+            "from_address": pi.keypair.public_key,
+            "to_address": user_wallet,
+            "network": pi.network
+        }
+
+        payment_id = await pi.create_payment(payment_data)
+        txid = await pi.submit_payment(payment_id, None)
+        await pi.complete_payment(payment_id, txid)
+
+        print(f"✅ Đã gửi A2U thành công: {txid}")
+        return jsonify({"success": True, "txid": txid, "to": user_wallet})
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"success": False, "message": str(e)}), 500
+
+@app.route("/api/a2u-gmop", methods=["POST"])
+async def a2u_gmop():
+    try:
+        data = await request.get_json()
+        amount = float(data.get("amount"))
+        to_wallet = data.get("to_wallet")
+
+        if amount < 1000 or amount > 10000:
+            return jsonify({
+                "success": False,
+                "message": "Giới hạn mỗi lần rút là 1000 - 10000 GMOP."
+            }), 400
+
+        if not to_wallet:
+            return jsonify({"success": False, "message": "Ví testnet của bạn chưa bật tài sản GMOP không thể nhận token"}), 400
+        try:
+            await pi.check_destination(to_wallet, GMOP_ASSET)
+        except InvalidDestination as e:
+            return jsonify({"success": False, "message": str(e), "code": e.code}), 400
+
+        txid = await pi.send_token(
+            asset_code=GMOP_ASSET_CODE,
+            asset_issuer=GMOP_ISSUER,
+            amount=str(amount),
+            destination=to_wallet
+        )
+        return jsonify({"success": True, "txid": txid, "to": to_wallet})
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"success": False, "message": str(e)}), 500
@@ -0,0 +1,108 @@
+# bench/async_client.py — chạy thẳng AsyncPiNetwork với Horizon + Pi API giả lập (không qua HTTP app)
+#
+#   python bench/async_client.py --payouts 200 --concurrency 100 --channels 8 --latency-ms 50 --ledger-close-ms 1000
+#
+# Thoát với mã 1 nếu có payout lỗi hoặc số giao dịch trên mock không khớp số payout thành công.
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+from collections import Counter
+
+import stellar_sdk as s_sdk
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from mock_server import add_arguments, server_options, start_server  # noqa: E402
+from pi_python import GMOP_ASSET_CODE, GMOP_ISSUER  # noqa: E402
+from pi_python_async import AsyncPiNetwork  # noqa: E402
+from run_bench import percentile  # noqa: E402
+
+
+async def pay_pi(pi, destination):
+    identifier = f"bench-{uuid.uuid4().hex[:16]}"
+    payment_id = await pi.create_payment({
+        "identifier": identifier,
+        "amount": "0.01",
+        "memo": identifier,
+        "to_address": destination,
+    })
+    txid = await pi.submit_payment(payment_id, None)
+    await pi.complete_payment(payment_id, txid)
+    return txid
+
+
+async def pay_gmop(pi, destination):
+    return await pi.send_token(GMOP_ASSET_CODE, GMOP_ISSUER, "1000", destination)
+
+
+async def run(args, mock_url):
+    pi = AsyncPiNetwork()
+    await pi.initialize(
+        api_key="bench-key",
+        wallet_private_key=s_sdk.Keypair.random().secret,
+        env="testnet",
+        horizon_url=mock_url,
+        base_url=mock_url,
+        channel_secrets=[s_sdk.Keypair.random().secret for _ in range(args.channels)],
+        sequence_lock_dir=args.lock_dir
+    )
+    pay = pay_gmop if args.kind == "gmop" else pay_pi
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    errors = Counter()
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await pay(pi, s_sdk.Keypair.random().public_key)
+            except Exception as e:
+                errors[type(e).__name__ + (f" {e}" if args.verbose else "")] += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.monotonic()
+    try:
+        await asyncio.gather(*(one() for _ in range(args.payouts)))
+    finally:
+        await pi.close()
+    return time.monotonic() - started, sorted(latencies), errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AsyncPiNetwork với mock Horizon / Pi API")
+    parser.add_argument("--payouts", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--kind", choices=("pi", "gmop"), default="pi")
+    parser.add_argument("--channels", type=int, default=0, help="Số channel account")
+    parser.add_argument("--mock-port", type=int, default=8901)
+    parser.add_argument("--lock-dir", default=None, help="Thư mục file lock sequence (mặc định thư mục tạm)")
+    parser.add_argument("--verbose", action="store_true", help="In chi tiết lỗi")
+    add_arguments(parser)
+    args = parser.parse_args()
+    if args.asset_issuer is None:
+        args.asset_issuer = GMOP_ISSUER
+
+    mock, mock_state = start_server("127.0.0.1", args.mock_port, **server_options(args))
+    try:
+        wall, latencies, errors = asyncio.run(run(args, f"http://127.0.0.1:{args.mock_port}"))
+    finally:
+        mock.shutdown()
+
+    ok = len(latencies) - sum(errors.values())
+    landed = len(mock_state.ledger)
+    print(f"⏱️  {args.payouts} payout {args.kind}, {args.concurrency} đồng thời: {wall:.2f}s "
+          f"({len(latencies) / wall:.1f}/s), p50 {percentile(latencies, 50):.0f}ms, "
+          f"p99 {percentile(latencies, 99):.0f}ms")
+    print(f"   thành công {ok}, lỗi {dict(errors)}, giao dịch trên mock {landed}")
+    print(f"   upstream: {mock_state.counters}")
+    if errors or landed != ok:
+        sys.exit(1)
+    print("✅ OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+# bench/mock_server.py — Horizon + Pi Platform API giả lập cho benchmark
+#
+#   python bench/mock_server.py --port 8900 --latency-ms 50 --submit-error-rate 0.01
+#
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import stellar_sdk as s_sdk
+
+START_SEQUENCE = 1000
+BASE_FEE = 100000
+
+
+def wallet_for_uid(uid):
+    # Ví cố định theo uid để các lần chạy lặp lại được
+    return s_sdk.Keypair.from_raw_ed25519_seed(hashlib.sha256(uid.encode()).digest()).public_key
+
+
+class MockState:
+    def __init__(self, network, latency_ms=0, jitter_ms=0, error_rate=0.0,
+                 submit_error_rate=0.0, seq_check=True, asset_codes=("GMOP",), asset_issuer=None,
+                 ledger_close_ms=0, missing_accounts=()):
+        self.network = network
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.submit_error_rate = submit_error_rate
+        self.seq_check = seq_check
+        self.asset_codes = asset_codes
+        self.asset_issuer = asset_issuer
+        self.ledger_close_ms = ledger_close_ms
+        self.missing_accounts = set(missing_accounts)  # ví "chưa kích hoạt": 404 và op_no_destination
+        self.sequences = {}
+        self.transactions = {}
+        self.ledger = []  # giao dịch đã "lên chain" theo thứ tự paging_token
+        self.lock = threading.Lock()
+        self.ledger_changed = threading.Condition(self.lock)
+        self.counters = {}
+
+    def count(self, key):
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    def delay(self):
+        latency = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if latency > 0:
+            time.sleep(latency / 1000)
+
+    def account(self, account_id):
+        with self.lock:
+            sequence = self.sequences.setdefault(account_id, START_SEQUENCE)
+        balances = [{"asset_type": "native", "balance": "1000000.0000000"}]
+        if self.asset_issuer:
+            for code in self.asset_codes:
+                balances.append({
+                    "asset_type": "credit_alphanum4",
+                    "asset_code": code,
+                    "asset_issuer": self.asset_issuer,
+                    "balance": "0.0000000",
+                    "limit": "922337203685.4775807"
+                })
+        return {
+            "id": account_id,
+            "account_id": account_id,
+            "sequence": str(sequence),
+            "balances": balances,
+            "data": {},
+            "thresholds": {"low_threshold": 0, "med_threshold": 0, "high_threshold": 0},
+            "signers": [{"key": account_id, "weight": 1, "type": "ed25519_public_key"}]
+        }
+
+    def submit(self, xdr, wait=True):
+        envelope = s_sdk.parse_transaction_envelope_from_xdr(xdr, self.network)
+        tx = envelope.transaction
+        fee_bump = hasattr(tx, "inner_transaction_envelope")
+        inner_envelope = tx.inner_transaction_envelope if fee_bump else envelope
+        inner = inner_envelope.transaction
+        source = inner.source.account_id
+        tx_hash = envelope.hash_hex()
+
+        def rejected(code, operations=None):
+            if fee_bump:
+                # Channel: core bọc mã của giao dịch bên trong như Horizon (inner_transaction)
+                return 400, result_codes("tx_fee_bump_inner_failed", operations, inner_transaction=code)
+            return 400, result_codes(code, operations)
+
+        with self.lock:
+            current = self.sequences.setdefault(source, START_SEQUENCE)
+            if self.seq_check and inner.sequence != current + 1:
+                return rejected("tx_bad_seq")
+            self.sequences[source] = inner.sequence
+
+        op_codes = [
+            "op_no_destination" if getattr(op, "destination", None) and op.destination.account_id in self.missing_accounts
+            else "op_success"
+            for op in inner.operations
+        ]
+        if "op_no_destination" in op_codes:
+            return rejected("tx_failed", op_codes)
+
+        if random.random() < self.submit_error_rate:
+            # tx_failed vẫn tiêu sequence như trên mạng thật
+            return rejected("tx_failed", ["op_underfunded"] * len(inner.operations))
+
+        accounts = {source} | {op.source.account_id for op in inner.operations if op.source}
+        if fee_bump:
+            accounts.add(tx.fee_source.account_id)
+        record = {
+            "id": tx_hash,
+            "hash": tx_hash,
+            "successful": True,
+            "source_account": source,
+            "source_account_sequence": str(inner.sequence),
+            "memo_type": "text" if isinstance(inner.memo, s_sdk.TextMemo) else "none",
+            "memo": inner.memo.memo_text.decode() if isinstance(inner.memo, s_sdk.TextMemo) else None,
+            "envelope_xdr": xdr,
+        }
+        if fee_bump:
+            record["inner_transaction"] = {"hash": inner_envelope.hash_hex()}
+
+        if wait:
+            # Horizon đồng bộ chờ ledger đóng mới trả lời
+            time.sleep(self.ledger_close_ms / 1000)
+            self.close_ledger(record, accounts)
+        else:
+            threading.Timer(self.ledger_close_ms / 1000, self.close_ledger, (record, accounts)).start()
+        return 200, record
+
+    def close_ledger(self, record, accounts):
+        with self.ledger_changed:
+            record["paging_token"] = str(len(self.ledger) + 1)
+            self.transactions[record["hash"]] = record
+            if "inner_transaction" in record:
+                self.transactions[record["inner_transaction"]["hash"]] = record
+            self.ledger.append((accounts, record))
+            self.ledger_changed.notify_all()
+
+    def submit_async(self, xdr):
+        status, body = self.submit(xdr, wait=False)
+        if status == 200:
+            return 201, {"tx_status": "PENDING", "hash": body["hash"]}
+        envelope = s_sdk.parse_transaction_envelope_from_xdr(xdr, self.network)
+        inner_hash = None
+        if hasattr(envelope.transaction, "inner_transaction_envelope"):
+            inner_hash = envelope.transaction.inner_transaction_envelope.hash()
+        result = error_result(body["extras"]["result_codes"], inner_hash)
+        return 400, {"tx_status": "ERROR", "hash": "", "error_result_xdr": result.to_xdr()}
+
+
+def result_codes(transaction, operations=None, inner_transaction=None):
+    codes = {"transaction": transaction}
+    if inner_transaction is not None:
+        codes["inner_transaction"] = inner_transaction
+    if operations is not None:
+        codes["operations"] = operations
+    return {
+        "type": "https://stellar.org/horizon-errors/transaction_failed",
+        "title": "Transaction Failed",
+        "status": 400,
+        "extras": {"result_codes": codes}
+    }
+
+
+def error_result(codes, inner_hash=None):
+    """TransactionResult XDR cho result_codes: mã op payment và innerResultPair khi là fee-bump."""
+    xdr = s_sdk.xdr
+    results = None
+    if codes.get("operations") is not None:
+        results = [
+            xdr.OperationResult(
+                xdr.OperationResultCode.opINNER,
+                xdr.OperationResultTr(
+                    xdr.OperationType.PAYMENT,
+                    payment_result=xdr.PaymentResult(getattr(xdr.PaymentResultCode, "PAYMENT_" + code[3:].upper()))
+                )
+            )
+            for code in codes["operations"]
+        ]
+    inner_code = codes.get("inner_transaction")
+    if inner_code is None:
+        outcome = xdr.TransactionResultResult(transaction_code(codes["transaction"]), results=results)
+    else:
+        inner = xdr.InnerTransactionResult(
+            xdr.Int64(0),
+            xdr.InnerTransactionResultResult(transaction_code(inner_code), results),
+            xdr.InnerTransactionResultExt(0)
+        )
+        outcome = xdr.TransactionResultResult(
+            transaction_code(codes["transaction"]),
+            inner_result_pair=xdr.InnerTransactionResultPair(xdr.Hash(inner_hash), inner)
+        )
+    return xdr.TransactionResult(xdr.Int64(0), outcome, xdr.TransactionResultExt(0))
+
+
+def transaction_code(code):
+    return getattr(s_sdk.xdr.TransactionResultCode, "tx" + code[3:].upper())
+
+
+def not_found():
+    return 404, {"type": "https://stellar.org/horizon-errors/not_found", "title": "Resource Missing", "status": 404}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Header và body ghi riêng → Nagle + delayed ACK cộng ~40ms mỗi request keep-alive
+    disable_nagle_algorithm = True
+    state = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _stream_transactions(self, account_id, cursor):
+        # SSE giống Horizon: mỗi giao dịch là một event, id = paging_token
+        state = self.state
+        position = len(state.ledger) if cursor in (None, "now") else int(cursor)
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        # requests-sse đọc theo khối 512 byte → đệm comment để event đi ngay
+        padding = b":" + b" " * 511 + b"\n\n"
+        try:
+            self.wfile.write(b'retry: 1000\nevent: open\ndata: "hello"\n\n' + padding)
+            self.wfile.flush()
+            while True:
+                with state.ledger_changed:
+                    if position >= len(state.ledger):
+                        state.ledger_changed.wait(timeout=10)
+                    entries = state.ledger[position:]
+                position += len(entries)
+                events = [
+                    f"id: {record['paging_token']}\ndata: {json.dumps(record)}\n\n"
+                    for accounts, record in entries if account_id in accounts
+                ]
+                self.wfile.write("".join(events).encode() + padding if events else b": keepalive\n\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _handle(self, method):
+        state = self.state
+        url = urlparse(self.path)
+        path = url.path.rstrip("/")
+        parts = path.strip("/").split("/")
+        body = self._body()
+        state.count(f"{method} /{parts[0]}")
+        state.delay()
+
+        if random.random() < state.error_rate:
+            return self._send(503, {"title": "Service Unavailable", "status": 503})
+
+        # ---------- Horizon ----------
+        if method == "GET" and parts[0] == "accounts" and len(parts) == 3 and parts[2] == "transactions" \
+                and "text/event-stream" in (self.headers.get("Accept") or ""):
+            return self._stream_transactions(parts[1], parse_qs(url.query).get("cursor", [None])[0])
+        if method == "GET" and parts[0] == "accounts" and len(parts) == 2:
+            if not s_sdk.StrKey.is_valid_ed25519_public_key(parts[1]) or parts[1] in state.missing_accounts:
+                return self._send(*not_found())
+            return self._send(200, state.account(parts[1]))
+        if method == "GET" and path == "/ledgers":
+            return self._send(200, {"_embedded": {"records": [{"sequence": 1, "base_fee_in_stroops": BASE_FEE}]}})
+        if method == "GET" and path == "/fee_stats":
+            charged = {p: str(BASE_FEE) for p in ("min", "mode", "p10", "p20", "p30", "p40", "p50",
+                                                  "p60", "p70", "p80", "p90", "p95", "p99", "max")}
+            return self._send(200, {
+                "last_ledger": "1",
+                "last_ledger_base_fee": str(BASE_FEE),
+                "ledger_capacity_usage": "0.1",
+                "fee_charged": charged,
+                "max_fee": charged
+            })
+        if method == "POST" and path == "/transactions":
+            xdr = parse_qs(body.decode()).get("tx", [""])[0]
+            return self._send(*state.submit(xdr))
+        if method == "POST" and path == "/transactions_async":
+            xdr = parse_qs(body.decode()).get("tx", [""])[0]
+            return self._send(*state.submit_async(xdr))
+        if method == "GET" and parts[0] == "transactions" and len(parts) == 2:
+            record = state.transactions.get(parts[1])
+            return self._send(200, record) if record else self._send(*not_found())
+
+        # ---------- Pi Platform API ----------
+        if parts[0] == "v2":
+            if method == "GET" and path == "/v2/me":
+                token = (self.headers.get("Authorization") or "").replace("Bearer ", "")
+                if not token or token.startswith("bad"):
+                    return self._send(401, {"error": "invalid_token"})
+                uid = hashlib.sha256(token.encode()).hexdigest()[:24]
+                return self._send(200, {"uid": uid, "username": f"user_{uid[:6]}"})
+            if method == "GET" and len(parts) == 3 and parts[1] == "users":
+                uid = parts[2]
+                return self._send(200, {"user": {"uid": uid, "wallet": {"public_key": wallet_for_uid(uid)}}})
+            if len(parts) >= 3 and parts[1] == "payments":
+                payment_id = parts[2]
+                if method == "GET" and len(parts) == 3:
+                    return self._send(200, {"identifier": payment_id, "status": {"developer_approved": True}})
+                if method == "POST" and len(parts) == 4 and parts[3] in ("approve", "complete"):
+                    payload = json.loads(body or b"{}")
+                    return self._send(200, {
+                        "identifier": payment_id,
+                        "status": {"developer_approved": True, "developer_completed": parts[3] == "complete"},
+                        "transaction": {"txid": payload.get("txid")} if payload.get("txid") else None
+                    })
+
+        return self._send(*not_found())
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+
+def start_server(host="127.0.0.1", port=8900, **options):
+    """Chạy mock server trong thread nền, trả về (server, state)."""
+    state = MockState(**options)
+    handler = type("BoundMockHandler", (MockHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+def add_arguments(parser):
+    parser.add_argument("--network", default="Pi Testnet")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Độ trễ giả lập mỗi request")
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Tỉ lệ trả 503 ngẫu nhiên")
+    parser.add_argument("--submit-error-rate", type=float, default=0.0, help="Tỉ lệ submit trả tx_failed")
+    parser.add_argument("--no-seq-check", action="store_true", help="Không kiểm tra sequence khi submit")
+    parser.add_argument("--asset-issuer", default=None, help="Issuer cho trustline GMOP giả lập")
+    parser.add_argument("--ledger-close-ms", type=float, default=0, help="Thời gian chờ ledger đóng sau khi submit")
+
+
+def server_options(args):
+    return {
+        "network": args.network,
+        "latency_ms": args.latency_ms,
+        "jitter_ms": args.jitter_ms,
+        "error_rate": args.error_rate,
+        "submit_error_rate": args.submit_error_rate,
+        "seq_check": not args.no_seq_check,
+        "asset_issuer": args.asset_issuer,
+        "ledger_close_ms": args.ledger_close_ms,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Horizon + Pi API giả lập")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server, _ = start_server(args.host, args.port, **server_options(args))
+    print(f"🧪 Mock Horizon + Pi API: http://{args.host}:{args.port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
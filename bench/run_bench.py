@@ -0,0 +1,217 @@
+# bench/run_bench.py — đo throughput / độ trễ các endpoint payout với Horizon + Pi API giả lập
+#
+#   python bench/run_bench.py --workers 4 --concurrency 32 --duration 20 --latency-ms 50
+#
+# Cần MongoDB đang chạy (MONGO_URI, mặc định mongodb://localhost:27017/chototpi_bench): app lưu payment
+# đồng bộ vào Mongo, thiếu Mongo thì mọi payout lỗi 500 → kiểm tra trước khi chạy, ví dụ
+#   docker run -d -p 27017:27017 mongo:7
+#
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+import stellar_sdk as s_sdk
+from pymongo import MongoClient
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from mock_server import add_arguments, server_options, start_server  # noqa: E402
+from pi_python import GMOP_ISSUER  # noqa: E402
+
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/chototpi_bench?serverSelectionTimeoutMS=2000")
+
+
+def check_mongo(uri):
+    """Ping Mongo trước khi chạy: thiếu Mongo thì kết quả bench chỉ toàn lỗi 500."""
+    client = MongoClient(uri, serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command("ping")
+    except Exception as e:
+        sys.exit(f"❌ Không kết nối được MongoDB ({uri}): {e}\n   Bench cần Mongo thật, đặt MONGO_URI hoặc chạy mongod local.")
+    finally:
+        client.close()
+
+
+def random_wallet():
+    return s_sdk.Keypair.random().public_key
+
+
+# Ví chưa kích hoạt trên mock → payout chắc chắn lỗi (op_no_destination)
+MISSING_WALLETS = [s_sdk.Keypair.random().public_key for _ in range(20)]
+
+
+def random_uid():
+    # uid[:6] khác nhau để identifier a2u không trùng
+    return uuid.uuid4().hex
+
+
+SCENARIOS = {
+    "verify-user": ("POST", "/api/verify-user", lambda: {"accessToken": f"tok-{uuid.uuid4().hex[:8]}"}),
+    "approve-payment": ("POST", "/approve-payment", lambda: {"paymentId": uuid.uuid4().hex}),
+    "a2u-direct": ("POST", "/api/a2u-direct", lambda: {"uid": random_uid(), "amount": "0.01", "to_wallet": random_wallet()}),
+    "a2u-test": ("POST", "/api/a2u-test", lambda: {"uid": random_uid(), "amount": "0.01"}),
+    "a2u-gmop": ("POST", "/api/a2u-gmop", lambda: {"amount": 1000, "to_wallet": random_wallet()}),
+    "a2u-missing-wallet": ("POST", "/api/a2u-direct",
+                           lambda: {"uid": random_uid(), "amount": "0.01", "to_wallet": random.choice(MISSING_WALLETS)}),
+}
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def start_app(args, mock_url):
+    env = {
+        **os.environ,
+        "PI_API_KEY": "bench-key",
+        "APP_PRIVATE_KEY": s_sdk.Keypair.random().secret,
+        "PI_ENV": "testnet",
+        "PI_HORIZON_URL": mock_url,
+        "PI_API_BASE_URL": mock_url,
+        "MONGO_URI": MONGO_URI,
+        "APP_CHANNEL_SECRETS": ",".join(s_sdk.Keypair.random().secret for _ in range(args.channels)),
+    }
+    bind = f"127.0.0.1:{args.app_port}"
+    if args.server == "hypercorn":
+        cmd = ["hypercorn", "-w", str(args.workers), "-b", bind, "asgi:app"]
+    else:
+        cmd = ["gunicorn", "-w", str(args.workers), "--threads", str(args.threads), "-b", bind,
+               "--timeout", "120", "app:app"]
+    log = open(os.path.join(args.output_dir, "app.log"), "w")
+    proc = subprocess.Popen(cmd, cwd=ROOT_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    base = f"http://{bind}"
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"❌ App thoát sớm, xem {log.name}")
+        try:
+            # /ready: worker đã warm-up Horizon xong
+            if requests.get(base + "/ready", timeout=1).status_code == 200:
+                return proc, base
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("❌ App không sẵn sàng kịp")
+
+
+def run_scenario(base, name, concurrency, duration):
+    method, path, make_body = SCENARIOS[name]
+    latencies = []
+    errors = Counter()
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+    local = threading.local()
+
+    def worker():
+        session = local.__dict__.setdefault("session", requests.Session())
+        while time.monotonic() < stop_at:
+            started = time.perf_counter()
+            try:
+                res = session.request(method, base + path, json=make_body(), timeout=60)
+                outcome = None if res.status_code < 400 else f"http_{res.status_code}"
+            except requests.RequestException as e:
+                outcome = type(e).__name__
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                latencies.append(elapsed)
+                if outcome:
+                    errors[outcome] += 1
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    wall = time.monotonic() - started
+
+    latencies.sort()
+    total = len(latencies)
+    return {
+        "requests": total,
+        "errors": sum(errors.values()),
+        "error_breakdown": dict(errors),
+        "duration_s": round(wall, 3),
+        "rps": round(total / wall, 2) if wall else 0,
+        "latency_ms": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1] if latencies else None,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark các endpoint payout")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Danh sách, cách nhau bởi dấu phẩy")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10, help="Giây cho mỗi scenario")
+    parser.add_argument("--server", choices=("gunicorn", "hypercorn"), default="gunicorn")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--channels", type=int, default=0, help="Số channel account (APP_CHANNEL_SECRETS)")
+    parser.add_argument("--app-port", type=int, default=8950)
+    parser.add_argument("--mock-port", type=int, default=8900)
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--output-dir", default=os.path.join(BENCH_DIR, "results"))
+    add_arguments(parser)
+    args = parser.parse_args()
+    if args.asset_issuer is None:
+        args.asset_issuer = GMOP_ISSUER
+
+    check_mongo(MONGO_URI)
+    os.makedirs(args.output_dir, exist_ok=True)
+    mock, mock_state = start_server("127.0.0.1", args.mock_port, missing_accounts=MISSING_WALLETS,
+                                    **server_options(args))
+    mock_url = f"http://127.0.0.1:{args.mock_port}"
+    proc, base = start_app(args, mock_url)
+
+    results = {}
+    try:
+        for name in [s.strip() for s in args.scenarios.split(",") if s.strip()]:
+            print(f"⏱️  {name}: {args.concurrency} kết nối trong {args.duration}s")
+            results[name] = run_scenario(base, name, args.concurrency, args.duration)
+            r = results[name]
+            print(f"   {r['rps']} req/s, p50 {r['latency_ms']['p50']:.1f}ms, "
+                  f"p95 {r['latency_ms']['p95']:.1f}ms, p99 {r['latency_ms']['p99']:.1f}ms, "
+                  f"lỗi {r['errors']} {r['error_breakdown']}")
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+        mock.shutdown()
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                                     capture_output=True, text=True).stdout.strip(),
+        "python": platform.python_version(),
+        "config": {k: v for k, v in vars(args).items() if k != "output_dir"},
+        "upstream_calls": mock_state.counters,
+        "results": results,
+    }
+    path = os.path.join(args.output_dir, f"bench-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Kết quả: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# cache.py
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+def hash_key(prefix, value):
+    # Không giữ access token thô trong bộ nhớ / Mongo
+    return f"{prefix}:{hashlib.sha256(str(value).encode()).hexdigest()}"
+
+
+class MongoCacheStore:
+    """Tầng thứ hai dùng chung giữa các worker gunicorn, dựa trên collection cache trong db.py."""
+
+    def __init__(self):
+        from db import cache_get, cache_set
+        self._get = cache_get
+        self._set = cache_set
+
+    def get(self, key):
+        return self._get(key)
+
+    def set(self, key, value, ttl):
+        self._set(key, value, ttl)
+
+
+class TTLCache:
+    """Cache LRU có TTL; các lần miss đồng thời cùng key chỉ gọi upstream một lần."""
+
+    def __init__(self, maxsize=10000, ttl=300, negative_ttl=30, cache_error=None, store=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.cache_error = cache_error or (lambda e: False)
+        self.store = store
+        self._entries = OrderedDict()  # key → (expires_at, value, is_error)
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put(self, key, value, ttl, is_error=False):
+        self._entries[key] = (time.monotonic() + ttl, value, is_error)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _begin(self, key):
+        # → (entry cache, future, có phải lượt gọi upstream không)
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                return entry, None, False
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        return None, future, leader
+
+    def _finish(self, key, future, value=None, error=None):
+        with self._lock:
+            if error is None:
+                self._put(key, value, self.ttl)
+            elif self.cache_error(error):
+                self._put(key, error, self.negative_ttl, is_error=True)
+            self._inflight.pop(key, None)
+        if error is None:
+            future.set_result(value)
+        else:
+            future.set_exception(error)
+
+    def get_or_load(self, key, loader):
+        entry, future, leader = self._begin(key)
+        if entry is not None:
+            if entry[2]:
+                raise entry[1]
+            return entry[1]
+        if not leader:
+            return future.result()
+
+        try:
+            value = self.store.get(key) if self.store else None
+            if value is None:
+                value = loader()
+                if self.store:
+                    self.store.set(key, value, self.ttl)
+        except Exception as e:
+            self._finish(key, future, error=e)
+            raise
+
+        self._finish(key, future, value)
+        return value
+
+    async def get_or_load_async(self, key, loader):
+        """Như get_or_load, loader là coroutine function (ASGI); store Mongo gọi qua thread."""
+        entry, future, leader = self._begin(key)
+        if entry is not None:
+            if entry[2]:
+                raise entry[1]
+            return entry[1]
+        if not leader:
+            return await asyncio.wrap_future(future)
+
+        try:
+            value = await asyncio.to_thread(self.store.get, key) if self.store else None
+            if value is None:
+                value = await loader()
+                if self.store:
+                    await asyncio.to_thread(self.store.set, key, value, self.ttl)
+        except Exception as e:
+            self._finish(key, future, error=e)
+            raise
+
+        self._finish(key, future, value)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
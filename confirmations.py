@@ -0,0 +1,211 @@
+# confirmations.py
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from pi_python import inner_transaction_hash
+
+
+class ConfirmationTracker:
+    """Một stream Horizon giao dịch của app account: khớp giao dịch đã lên chain với payment đang chờ
+    theo hash (hoặc memo), rồi gọi Pi /v2/payments/{id}/complete theo lô."""
+
+    def __init__(self, pi, batch_size=50, flush_interval=1.0, complete_workers=8,
+                 sweep_interval=15, sweep_after=20, expire_after=210, lease_seconds=300):
+        self.pi = pi
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sweep_interval = sweep_interval
+        self.sweep_after = sweep_after
+        # > timeout giao dịch (180s): quá mốc này giao dịch chưa lên chain thì không bao giờ lên nữa
+        self.expire_after = expire_after
+        self.lease_seconds = lease_seconds
+        self.cursor = "now"
+        self._by_hash = {}    # tx_hash → payment_id
+        self._by_memo = {}    # memo → payment_id
+        self._watched = {}    # payment_id → (hashes, memo, watched_at, envelope mới nhất)
+        self._confirmed = []  # (payment_id, tx record)
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._executor = ThreadPoolExecutor(max_workers=complete_workers, thread_name_prefix="complete")
+        self._pid = None
+
+    def start(self):
+        # Thread không sống qua fork → mỗi worker gunicorn tự mở stream riêng
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        for target in (self._stream_loop, self._complete_loop, self._sweep_loop):
+            threading.Thread(target=target, daemon=True).start()
+
+    def watch(self, payment_id, envelope, memo=None):
+        self.start()
+        # Hash ngoài (khớp stream) và hash bên trong (giống nhau nếu không qua channel)
+        hashes = list(dict.fromkeys([envelope.hash_hex(), inner_transaction_hash(envelope)]))
+        with self._lock:
+            previous = self._watched.get(payment_id)
+            if previous:
+                # Ký lại (tx_bad_seq) → sequence mới, giao dịch cũ không thể lên chain nữa
+                for old_hash in previous[0]:
+                    self._by_hash.pop(old_hash, None)
+            self._watched[payment_id] = (hashes, memo, time.monotonic(), envelope)
+            for tx_hash in hashes:
+                self._by_hash[tx_hash] = payment_id
+            # Chỉ khớp theo memo khi memo là chính identifier (memo chung như "Chototpi thanh toán" thì bỏ qua)
+            if memo == payment_id:
+                self._by_memo[memo] = payment_id
+
+    def forget(self, payment_id):
+        with self._lock:
+            self._unwatch(payment_id)
+
+    def _unwatch(self, payment_id):
+        hashes, memo, _, _ = self._watched.pop(payment_id, ((), None, None, None))
+        for tx_hash in hashes:
+            self._by_hash.pop(tx_hash, None)
+        if memo and self._by_memo.get(memo) == payment_id:
+            del self._by_memo[memo]
+
+    # ------------------------------
+    #  Stream Horizon (resume theo cursor khi mất kết nối)
+    # ------------------------------
+    def _stream_loop(self):
+        backoff = 1
+        while True:
+            try:
+                builder = (
+                    self.pi.server.transactions()
+                    .for_account(self.pi.keypair.public_key)
+                    .cursor(self.cursor)
+                )
+                for tx in builder.stream():
+                    backoff = 1
+                    self.cursor = tx.get("paging_token", self.cursor)
+                    self._match(tx)
+            except Exception as e:
+                print(f"❌ Stream Horizon lỗi, kết nối lại sau {backoff}s (cursor={self.cursor}): {e}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def _match(self, tx):
+        hashes = [tx.get("hash"), (tx.get("inner_transaction") or {}).get("hash")]
+        with self._cond:
+            payment_id = next((self._by_hash[h] for h in hashes if h in self._by_hash), None)
+            if payment_id is None and tx.get("memo_type") == "text":
+                payment_id = self._by_memo.get(tx.get("memo"))
+            if payment_id is None:
+                return
+            self._unwatch(payment_id)
+            self._confirmed.append((payment_id, tx))
+            # Đánh thức thread complete khi có phần tử đầu tiên (chờ gom thêm) hoặc khi đủ lô
+            if len(self._confirmed) in (1, self.batch_size):
+                self._cond.notify()
+
+    # ------------------------------
+    #  Dò lại payment chưa thấy trên stream (lúc đang kết nối lại, ...)
+    # ------------------------------
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            with self._lock:
+                now = time.monotonic()
+                overdue = [(payment_id, list(hashes), now - watched_at >= self.expire_after)
+                           for payment_id, (hashes, _, watched_at, _) in self._watched.items()
+                           if now - watched_at >= self.sweep_after]
+            for payment_id, hashes, expired in overdue:
+                try:
+                    tx = self._find(hashes)
+                except Exception as e:
+                    print(f"❌ Không tra được giao dịch {hashes[0][:12]}…: {e}")
+                    continue
+                if tx is not None:
+                    self._match(tx)
+                elif expired:
+                    self._expire(payment_id)
+                else:
+                    self._bump(payment_id)
+
+    def _find(self, hashes):
+        for tx_hash in hashes:
+            tx = self.pi._find_transaction(tx_hash)
+            if tx is not None:
+                return tx
+        return None
+
+    def _bump(self, payment_id):
+        """Chưa lên chain sau sweep_after → bọc lại đúng giao dịch đã ký bằng fee-bump phí cao hơn."""
+        with self._lock:
+            watched = self._watched.get(payment_id)
+        if watched is None:
+            return
+        envelope = watched[3]
+        bumped = self.pi._fee_bump(envelope)
+        if bumped is None:
+            return
+        # Hash inner không đổi qua các lần bump → reconcile tra theo hash này thấy được bản nào lên chain
+        inner_hash = inner_transaction_hash(bumped)
+        try:
+            self.pi.open_payments.mark(payment_id, "accepted", extra={"tx_hash": inner_hash})
+        except Exception as e:
+            print(f"❌ Không lưu được hash fee-bump cho {payment_id}: {e}")
+            return
+        with self._lock:
+            watched = self._watched.get(payment_id)
+            if watched is None:
+                return
+            hashes, memo, watched_at, _ = watched
+            for tx_hash in (inner_hash, bumped.hash_hex()):
+                if tx_hash not in hashes:
+                    hashes.append(tx_hash)
+                self._by_hash[tx_hash] = payment_id
+            self._watched[payment_id] = (hashes, memo, watched_at, bumped)
+        print(f"⛽ Fee-bump giao dịch {inner_hash[:12]}… của {payment_id}, phí {bumped.transaction.fee}")
+        try:
+            self.pi._submit_accepted(bumped)
+        except Exception as e:
+            # Bản cũ vẫn có thể lên chain → giữ theo dõi, hết hạn thì reconcile
+            print(f"❌ Fee-bump {payment_id} lỗi: {e}")
+
+    def _expire(self, payment_id):
+        """Quá time bounds mà chưa lên chain → bỏ theo dõi, giao cho reconcile ký lại."""
+        with self._lock:
+            self._unwatch(payment_id)
+        self._executor.submit(self._reconcile, payment_id)
+
+    def _reconcile(self, payment_id):
+        try:
+            if not self.pi.open_payments.claim(payment_id, self.lease_seconds):
+                return
+            print(f"⌛ Giao dịch của {payment_id} hết hạn mà chưa lên chain")
+            self.pi._reconcile_payment(self.pi.open_payments.get(payment_id))
+        except Exception as e:
+            # Giữ trạng thái accepted → reconcile lúc khởi động sẽ xử lý lại
+            print(f"❌ Reconcile {payment_id} lỗi: {e}")
+
+    # ------------------------------
+    #  Complete theo lô
+    # ------------------------------
+    def _complete_loop(self):
+        while True:
+            with self._cond:
+                while not self._confirmed:
+                    self._cond.wait()
+                if len(self._confirmed) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                batch = self._confirmed[:self.batch_size]
+                del self._confirmed[:self.batch_size]
+            list(self._executor.map(self._complete, batch))
+
+    def _complete(self, item):
+        payment_id, tx = item
+        try:
+            if not tx.get("successful", True):
+                self.pi.open_payments.mark(payment_id, "failed", error="tx_failed")
+                return
+            self.pi.complete_payment(payment_id, tx["hash"])
+            print(f"✅ Đã xác nhận & complete {payment_id}: {tx['hash']}")
+        except Exception:
+            # Giữ trạng thái accepted/submitted → reconcile sẽ complete lại
+            traceback.print_exc()
@@ -1,38 +1,174 @@
 # db.py
 import os
-from pymongo import MongoClient
+import time
+import atexit
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from pymongo import MongoClient, ASCENDING, InsertOne, UpdateOne, UpdateMany
+from pymongo.errors import BulkWriteError
 from dotenv import load_dotenv
+from metrics import DB_SECONDS, timed_db
 
 load_dotenv()
 
 mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017/chototpi")
-mongo_client = MongoClient(mongo_uri)
+# connect=False: chưa mở kết nối/thread monitor lúc import → an toàn khi gunicorn preload_app rồi fork
+mongo_client = MongoClient(mongo_uri, connect=False)
 db = mongo_client.get_database()
 payments_collection = db["payments"]
+cache_collection = db["cache"]
+
+# ✅ Gom ghi vào bulk_write, flush theo số lượng / thời gian và khi thoát process
+class WriteBehindBuffer:
+    def __init__(self, collection, max_ops=200, interval=0.2):
+        self.collection = collection
+        self.max_ops = max_ops
+        self.interval = interval
+        self._ops = []
+        self._keys = set()  # payment_id có lệnh ghi chưa flush
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._retry_at = 0  # flush lỗi → request không tự flush nữa, để thread nền thử lại
+
+    def add(self, op, keys=()):
+        with self._lock:
+            self._ops.append(op)
+            self._keys.update(keys)
+            size = len(self._ops)
+            # Thread không sống qua fork → mỗi worker gunicorn tự khởi động lại
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        if size >= self.max_ops and time.monotonic() >= self._retry_at:
+            self.flush()
+
+    def pending(self, key):
+        with self._lock:
+            return key in self._keys
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                # Lỗi bất ngờ không được làm chết thread → op còn lại không bao giờ được ghi
+                print("❌ Mongo write-behind error:", e)
+
+    def _requeue(self, ops, keys):
+        # Giữ đúng thứ tự: op chưa ghi đứng trước op mới thêm trong lúc flush
+        # (giữ cả lô keys: thừa chỉ làm đọc flush thêm một lần)
+        with self._lock:
+            self._ops[:0] = ops
+            self._keys |= keys
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                ops, self._ops = self._ops, []
+                keys, self._keys = self._keys, set()
+            if not ops:
+                return True
+            try:
+                with DB_SECONDS.labels("bulk_write").time():
+                    self.collection.bulk_write(ops, ordered=True)
+                self._retry_at = 0
+                return True
+            except BulkWriteError as e:
+                write_errors = e.details.get("writeErrors") or []
+                if not write_errors:
+                    # Chỉ writeConcernError: op đã chạy nhưng chưa chắc bền → xếp lại cả lô như lỗi kết nối
+                    print(f"❌ Mongo bulk_write write concern error ({len(ops)} ops, sẽ thử lại):", e)
+                    self._requeue(ops, keys)
+                    self._retry_at = time.monotonic() + 5
+                    return False
+                # ordered=True: op trước lỗi đã ghi, op lỗi bỏ (ghi lại cũng lỗi), phần sau chưa chạy → xếp lại
+                error = write_errors[0]
+                print(f"❌ Mongo bulk_write bỏ op #{error['index']}:", error.get("errmsg"))
+                self._requeue(ops[error["index"] + 1:], keys)
+                return False
+            except Exception as e:
+                # Mất kết nối / timeout: chưa biết op nào đã ghi → xếp lại cả lô ($set ghi lại vẫn đúng)
+                print(f"❌ Mongo bulk_write error ({len(ops)} ops, sẽ thử lại):", e)
+                self._requeue(ops, keys)
+                self._retry_at = time.monotonic() + 5
+                return False
+
+    def close(self, attempts=3):
+        """Flush khi thoát process, thử lại vài lần trước khi bỏ."""
+        for attempt in range(attempts):
+            if self.flush() and not self._ops:
+                return True
+            time.sleep(1)
+        print(f"❌ Mất {len(self._ops)} lệnh ghi Mongo chưa flush khi thoát")
+        return False
+
+payment_writes = WriteBehindBuffer(payments_collection)
+atexit.register(payment_writes.close)
+
+# ✅ Tạo index khi khởi động
+@timed_db
+def ensure_indexes():
+    try:
+        payments_collection.create_index([("payment_id", ASCENDING)], unique=True)
+        payments_collection.create_index([("status", ASCENDING), ("updated_at", ASCENDING)])
+        cache_collection.create_index("expires_at", expireAfterSeconds=0)
+        return True
+    except Exception as e:
+        # Ví dụ: payment_id trùng từ dữ liệu cũ làm index unique thất bại
+        print("❌ Mongo ensure_indexes error:", e)
+        return False
+
+def _projection(fields):
+    if not fields:
+        return None
+    return {"_id": 0, **{field: 1 for field in fields}}
 
 # ✅ Lưu payment
-def save_payment(payment_data):
+@timed_db
+def save_payment(payment_data, buffered=False):
     try:
+        if buffered:
+            payment_writes.add(InsertOne(payment_data), keys=[payment_data.get("payment_id")])
+            return payment_data.get("payment_id")
         result = db["payments"].insert_one(payment_data)
         return str(result.inserted_id)
     except Exception as e:
         print("❌ Mongo save_payment error:", e)
         return None
 
-# ✅ Lấy payment theo payment_id
-def get_payment_by_id(payment_id):
+# ✅ Lấy payment theo payment_id (fields: chỉ lấy các trường cần)
+@timed_db
+def get_payment_by_id(payment_id, fields=None):
     try:
-        return db["payments"].find_one({"payment_id": payment_id})
+        # Chỉ flush khi payment này còn lệnh ghi trễ (poll /api/a2u-jobs không phá việc gom ghi)
+        if payment_writes.pending(payment_id):
+            payment_writes.flush()
+        return db["payments"].find_one({"payment_id": payment_id}, _projection(fields))
     except Exception as e:
         print("❌ Mongo get_payment_by_id error:", e)
         return None
 
-# ✅ Cập nhật trạng thái payment
-def update_payment_status(payment_id, status, txid=None):
+# ✅ Cập nhật trạng thái payment (buffered: ghi trễ qua bulk_write)
+@timed_db
+def update_payment_status(payment_id, status, txid=None, error=None, extra=None, buffered=False):
     try:
-        update_data = {"status": status}
+        update_data = {"status": status, "updated_at": time.time()}
         if txid:
             update_data["txid"] = txid
+        if error:
+            update_data["error"] = error
+        if extra:
+            update_data.update(extra)
+        if buffered:
+            payment_writes.add(UpdateOne({"payment_id": payment_id}, {"$set": update_data}), keys=[payment_id])
+            return True
+        # Ghi đồng bộ sau các lệnh đang chờ để giữ đúng thứ tự
+        payment_writes.flush()
         db["payments"].update_one(
             {"payment_id": payment_id},
             {"$set": update_data}
@@ -41,3 +177,142 @@ def update_payment_status(payment_id, status, txid=None):
     except Exception as e:
         print("❌ Mongo update_payment_status error:", e)
         return False
+
+# ✅ Cập nhật cùng trạng thái cho nhiều payment (payout trong một giao dịch lô)
+@timed_db
+def update_many_payment_status(payment_ids, status, txid=None, error=None, extra=None, buffered=False):
+    try:
+        update_data = {"status": status, "updated_at": time.time()}
+        if txid:
+            update_data["txid"] = txid
+        if error:
+            update_data["error"] = error
+        if extra:
+            update_data.update(extra)
+        payment_ids = list(payment_ids)
+        op = UpdateMany({"payment_id": {"$in": payment_ids}}, {"$set": update_data})
+        if buffered:
+            payment_writes.add(op, keys=payment_ids)
+            return True
+        payment_writes.flush()
+        payments_collection.bulk_write([op])
+        return True
+    except Exception as e:
+        print("❌ Mongo update_many_payment_status error:", e)
+        return False
+
+# ✅ Tạo nhiều payment theo payment_id (idempotency key) trong một bulk_write.
+# Trả về set payment_id mới tạo; payment_id đã có thì giữ nguyên bản cũ. None nếu lỗi.
+@timed_db
+def insert_payments_once(payments):
+    ops = [UpdateOne({"payment_id": p["payment_id"]}, {"$setOnInsert": p}, upsert=True) for p in payments]
+    try:
+        result = payments_collection.bulk_write(ops, ordered=False)
+        upserted = result.upserted_ids.keys()
+    except BulkWriteError as e:
+        # Hai request cùng key chạy song song → một bên gặp duplicate key, coi như đã có
+        if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+            print("❌ Mongo insert_payments_once error:", e)
+            return None
+        upserted = [u["index"] for u in e.details.get("upserted", [])]
+    except Exception as e:
+        print("❌ Mongo insert_payments_once error:", e)
+        return None
+    return {payments[index]["payment_id"] for index in upserted}
+
+# ✅ Tạo payment nếu chưa có (không ghi đè trạng thái hiện tại)
+@timed_db
+def upsert_payment(payment_id, fields):
+    try:
+        now = time.time()
+        db["payments"].update_one(
+            {"payment_id": payment_id},
+            {
+                "$set": {**fields, "updated_at": now},
+                "$setOnInsert": {"status": "created", "created_at": now}
+            },
+            upsert=True
+        )
+        return True
+    except Exception as e:
+        print("❌ Mongo upsert_payment error:", e)
+        return False
+
+# ✅ Payment chưa xong và không đổi trạng thái từ `idle_seconds` giây
+@timed_db
+def find_stale_payments(statuses, idle_seconds, fields=None):
+    try:
+        payment_writes.flush()
+        return list(db["payments"].find({
+            "status": {"$in": list(statuses)},
+            "updated_at": {"$lt": time.time() - idle_seconds}
+        }, _projection(fields)))
+    except Exception as e:
+        print("❌ Mongo find_stale_payments error:", e)
+        return []
+
+# ✅ Giữ quyền xử lý payment trong `lease_seconds` giây (tránh 2 worker cùng reconcile)
+@timed_db
+def claim_payment(payment_id, lease_seconds):
+    try:
+        now = time.time()
+        return db["payments"].find_one_and_update(
+            {
+                "payment_id": payment_id,
+                "$or": [{"lease_until": {"$exists": False}}, {"lease_until": {"$lt": now}}]
+            },
+            {"$set": {"lease_until": now + lease_seconds}}
+        )
+    except Exception as e:
+        print("❌ Mongo claim_payment error:", e)
+        return None
+
+# ✅ Nhận job đang xếp hàng: queued → processing kèm lease; job reconcile / worker khác đã nhận thì bỏ qua.
+# Trả về set payment_id đã nhận được.
+@timed_db
+def claim_queued_payments(payment_ids, lease_seconds):
+    try:
+        now = time.time()
+        token = uuid.uuid4().hex
+        payment_writes.flush()
+        payment_ids = list(payment_ids)
+        payments_collection.update_many(
+            {
+                "payment_id": {"$in": payment_ids},
+                "status": "queued",
+                "$or": [{"lease_until": {"$exists": False}}, {"lease_until": {"$lt": now}}]
+            },
+            {"$set": {"status": "processing", "lease_until": now + lease_seconds, "claim": token, "updated_at": now}}
+        )
+        # Lọc theo payment_id để dùng index, claim chỉ để biết bản ghi nào do lần gọi này giành được
+        claimed = payments_collection.find(
+            {"payment_id": {"$in": payment_ids}, "claim": token}, {"_id": 0, "payment_id": 1}
+        )
+        return {doc["payment_id"] for doc in claimed}
+    except Exception as e:
+        print("❌ Mongo claim_queued_payments error:", e)
+        return set()
+
+# ✅ Cache dùng chung giữa các worker (Mongo tự xoá theo expires_at, index tạo trong ensure_indexes)
+@timed_db
+def cache_get(key):
+    try:
+        doc = cache_collection.find_one({"_id": key, "expires_at": {"$gt": datetime.now(timezone.utc)}})
+        return doc["value"] if doc else None
+    except Exception as e:
+        print("❌ Mongo cache_get error:", e)
+        return None
+
+@timed_db
+def cache_set(key, value, ttl):
+    try:
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=ttl)
+        cache_collection.replace_one(
+            {"_id": key},
+            {"_id": key, "value": value, "expires_at": expires_at},
+            upsert=True
+        )
+        return True
+    except Exception as e:
+        print("❌ Mongo cache_set error:", e)
+        return False
@@ -0,0 +1,26 @@
+# gunicorn.conf.py
+import os
+import shutil
+
+# Import app một lần ở master (parse key, Asset, cấu hình) rồi fork; worker sẵn sàng phục vụ ngay.
+# Tắt bằng GUNICORN_PRELOAD=0 (ví dụ khi cần reload code từng worker).
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+
+def on_starting(server):
+    # Xoá số liệu của lần chạy trước (Prometheus multiprocess)
+    metrics_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from metrics import mark_process_dead
+    mark_process_dead(worker.pid)
+
+
+def post_worker_init(worker):
+    # Thread không sống qua fork → warm-up Horizon, stream xác nhận, reconcile khởi động trong từng worker
+    from app import start_background
+    start_background()
@@ -0,0 +1,144 @@
+# jobs.py
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from cache import hash_key
+from db import save_payment, get_payment_by_id, update_payment_status, insert_payments_once, claim_queued_payments
+from pi_python import shared_asset
+
+# Trạng thái job: queued → processing → submitting → submitted | accepted → completed | failed
+JOB_FIELDS = ("payment_id", "status", "txid", "error", "amount", "asset_code", "to_address", "created_at", "updated_at")
+
+
+def new_identifier(uid):
+    # Memo tối đa 28 byte: a2u-xxxxxx-<epoch>-<6 hex>
+    return f"a2u-{uid[:6]}-{int(time.time())}-{uuid.uuid4().hex[:6]}"
+
+
+class PayoutQueue:
+    """Chạy create → submit → complete trên worker pool, trạng thái lưu trong collection payments."""
+
+    def __init__(self, pi, resolve_wallet=None, workers=4, lease_seconds=300):
+        self.pi = pi
+        self.resolve_wallet = resolve_wallet
+        self.lease_seconds = lease_seconds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="a2u")
+
+    def enqueue(self, uid, amount, to_wallet=None, memo=None):
+        identifier = new_identifier(uid)
+        payment_data = {
+            "user_uid": uid,
+            "amount": amount,
+            "memo": memo or identifier,
+            "metadata": {"source": "a2u"},
+            "identifier": identifier,
+            "from_address": self.pi.keypair.public_key,
+            "to_address": to_wallet,
+            "network": self.pi.network
+        }
+
+        now = time.time()
+        saved = save_payment({
+            **payment_data,
+            "payment_id": identifier,
+            "status": "queued",
+            "created_at": now,
+            "updated_at": now
+        })
+        if saved is None:
+            raise RuntimeError("❌ Không thể lưu job vào Mongo!")
+
+        self._executor.submit(self._run, payment_data)
+        return identifier
+
+    def enqueue_batch(self, payouts):
+        """payouts: list dict {to_wallet, amount, asset_code, asset_issuer, key?}.
+
+        Mỗi payout là một bản ghi "transfer" riêng để poll / reconcile. `key` (idempotency key của client)
+        → payment_id cố định: gửi lại cùng key không tạo payout thứ hai. Trả về list (job_id, duplicate).
+        """
+        now = time.time()
+        records = []
+        for payout in payouts:
+            key = payout.get("key")
+            payment_id = hash_key("batch", key)[:34] if key else f"batch-{uuid.uuid4().hex}"
+            records.append({
+                "payment_id": payment_id,
+                "kind": "transfer",
+                "amount": payout["amount"],
+                "asset_code": payout.get("asset_code"),
+                "asset_issuer": payout.get("asset_issuer"),
+                "from_address": self.pi.keypair.public_key,
+                "to_address": payout["to_wallet"],
+                "network": self.pi.network,
+                "status": "queued",
+                "created_at": now,
+                "updated_at": now
+            })
+
+        created = insert_payments_once(records)
+        if created is None:
+            raise RuntimeError("❌ Không thể lưu payout lô vào Mongo!")
+
+        fresh, jobs = [], []
+        for record in records:
+            duplicate = record["payment_id"] not in created
+            if not duplicate:
+                # Key lặp lại trong cùng request cũng chỉ gửi một lần
+                created.discard(record["payment_id"])
+                fresh.append(record)
+            jobs.append((record["payment_id"], duplicate))
+
+        if fresh:
+            self._executor.submit(self._run_batch, fresh)
+        return jobs
+
+    def _run_batch(self, records):
+        claimed = claim_queued_payments([record["payment_id"] for record in records], self.lease_seconds)
+        records = [record for record in records if record["payment_id"] in claimed]
+        if not records:
+            return
+        try:
+            # PiNetwork gom vào giao dịch nhiều op và cập nhật submitting → completed | failed
+            self.pi.send_batch([{
+                "destination": record["to_address"],
+                "amount": record["amount"],
+                "asset": shared_asset(record["asset_code"], record["asset_issuer"]),
+                "payment_id": record["payment_id"]
+            } for record in records])
+            print(f"✅ Đã xử lý payout lô: {len(records)}")
+        except Exception:
+            traceback.print_exc()
+
+    def _run(self, payment_data):
+        identifier = payment_data["identifier"]
+        # Job chờ lâu trong executor có thể đã bị reconcile (worker khác) nhận → chỉ chạy khi nhận được
+        if identifier not in claim_queued_payments([identifier], self.lease_seconds):
+            print(f"⏭️ Job {identifier} đã được xử lý ở nơi khác")
+            return
+        try:
+            if not payment_data["to_address"]:
+                payment_data["to_address"] = self.resolve_wallet(payment_data["user_uid"])
+
+            # PiNetwork tự cập nhật submitting → submitted/accepted → completed qua payment store
+            payment_id = self.pi.create_payment(payment_data)
+            txid = self.pi.pay(payment_id)
+            print(f"✅ Job {identifier} đã gửi: {txid}")
+        except Exception as e:
+            traceback.print_exc()
+            status = "failed"
+            try:
+                payment = self.pi.open_payments.get(identifier)
+                # Đã có txid hoặc tx đã ký mà chưa rõ kết quả → để reconcile xử lý, không đánh failed
+                if payment.get("txid") or (payment.get("status") in ("submitting", "accepted") and payment.get("tx_hash")):
+                    status = payment["status"]
+            except KeyError:
+                pass
+            update_payment_status(identifier, status, error=str(e))
+
+    def status(self, job_id):
+        payment = get_payment_by_id(job_id, fields=JOB_FIELDS)
+        if not payment:
+            return None
+        return {field: payment.get(field) for field in JOB_FIELDS}
@@ -0,0 +1,111 @@
+# metrics.py — histogram / counter Prometheus cho pipeline payout
+#
+# Chạy nhiều worker gunicorn: đặt PROMETHEUS_MULTIPROC_DIR (thư mục trống, ghi được)
+# trước khi khởi động; gunicorn.conf.py dọn thư mục và đánh dấu worker đã thoát.
+import os
+import time
+from contextlib import contextmanager
+from functools import wraps
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "a2u_http_request_seconds", "Thời gian xử lý request Flask",
+    ["route", "method", "status"], buckets=LATENCY_BUCKETS
+)
+PAYOUT_STAGE_SECONDS = Histogram(
+    "a2u_payout_stage_seconds", "Thời gian từng bước payout (sequence, build, sign, submit, complete)",
+    ["stage"], buckets=LATENCY_BUCKETS
+)
+UPSTREAM_SECONDS = Histogram(
+    "a2u_upstream_request_seconds", "Thời gian gọi Horizon / Pi API theo kết quả",
+    ["upstream", "operation", "result"], buckets=LATENCY_BUCKETS
+)
+DB_SECONDS = Histogram(
+    "a2u_db_operation_seconds", "Thời gian thao tác Mongo trong db.py",
+    ["operation"], buckets=LATENCY_BUCKETS
+)
+HORIZON_RESULT_CODES = Counter(
+    "a2u_horizon_result_codes", "Mã lỗi Horizon (tx_bad_seq, op_no_trust, ...)",
+    ["code"]
+)
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+
+@contextmanager
+def stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        PAYOUT_STAGE_SECONDS.labels(name).observe(time.perf_counter() - started)
+
+
+@contextmanager
+def upstream(name, operation):
+    started = time.perf_counter()
+    result = "ok"
+    try:
+        yield
+    except Exception as e:
+        result = error_result(e)
+        raise
+    finally:
+        UPSTREAM_SECONDS.labels(name, operation, result).observe(time.perf_counter() - started)
+
+
+def error_result(error):
+    # Mã HTTP / mã giao dịch Horizon nếu có, nếu không thì tên exception
+    extras = getattr(error, "extras", None) or {}
+    codes = extras.get("result_codes") or {}
+    # Fee-bump (channel): mã thật nằm ở inner_transaction, không phải tx_fee_bump_inner_failed
+    code = codes.get("inner_transaction") or codes.get("transaction")
+    if code:
+        return code
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    return str(status) if status else type(error).__name__
+
+
+def record_horizon_error(error):
+    extras = getattr(error, "extras", None) or {}
+    result_codes = extras.get("result_codes") or {}
+    code = result_codes.get("inner_transaction") or result_codes.get("transaction")
+    if code:
+        HORIZON_RESULT_CODES.labels(code).inc()
+    for code in result_codes.get("operations") or []:
+        if code != "op_success":
+            HORIZON_RESULT_CODES.labels(code).inc()
+
+
+def observe_request(route, method, status, seconds):
+    HTTP_REQUEST_SECONDS.labels(route, method, str(status)).observe(seconds)
+
+
+def timed_db(fn):
+    histogram = DB_SECONDS.labels(fn.__name__)
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - started)
+    return wrapper
+
+
+def render():
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def mark_process_dead(pid):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,95 @@
+# payment_store.py
+import threading
+from collections import OrderedDict
+
+FINAL_STATUSES = ("completed", "failed")
+# Mất các bản ghi này khi crash vẫn an toàn: reconcile dựa vào tx_hash đã ghi đồng bộ
+BUFFERED_STATUSES = ("submitted", "completed")
+UNFINISHED_STATUSES = ("queued", "processing", "created", "submitting", "accepted", "submitted")
+
+
+class PaymentStore:
+    """Working set nhỏ cho payment đang xử lý, ghi xuyên xuống collection payments khi `persist`."""
+
+    def __init__(self, persist=True, maxsize=1000):
+        self.persist = persist
+        self.maxsize = maxsize
+        self._payments = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if persist:
+            import db
+            self._db = db
+
+    def __len__(self):
+        return len(self._payments)
+
+    def _remember(self, payment):
+        with self._lock:
+            self._payments[payment["payment_id"]] = payment
+            self._payments.move_to_end(payment["payment_id"])
+            # Có Mongo → bản bỏ đi nạp lại được. Không persist → bản cũ nhất là payment bỏ dở
+            # (lỗi giữa chừng, không bao giờ tới trạng thái cuối), bỏ đi để bộ nhớ không tăng mãi
+            while len(self._payments) > self.maxsize:
+                self._payments.popitem(last=False)
+
+    def put(self, payment_data):
+        identifier = payment_data["identifier"]
+        if self.persist and not self._db.upsert_payment(identifier, payment_data):
+            raise RuntimeError(f"❌ Không thể lưu payment {identifier}")
+        self._remember({**payment_data, "payment_id": identifier, "status": "created"})
+
+    def get(self, identifier):
+        with self._lock:
+            payment = self._payments.get(identifier)
+        if payment is None and self.persist:
+            # Payment tạo ở worker khác
+            payment = self._db.get_payment_by_id(identifier)
+            if payment:
+                self._remember(payment)
+        if payment is None:
+            raise KeyError(identifier)
+        return payment
+
+    def mark(self, identifier, status, txid=None, error=None, extra=None):
+        with self._lock:
+            payment = self._payments.get(identifier)
+            if payment is not None:
+                payment.update(extra or {}, status=status)
+                if txid:
+                    payment["txid"] = txid
+                if status in FINAL_STATUSES:
+                    del self._payments[identifier]
+        # Ghi đồng bộ lỗi (vd. tx_hash trước khi submit) → dừng luôn, không để reconcile gửi lại tx đã lên chain
+        if self.persist and not self._db.update_payment_status(
+            identifier, status, txid, error=error, extra=extra,
+            buffered=status in BUFFERED_STATUSES
+        ):
+            raise RuntimeError(f"❌ Không thể lưu trạng thái {status} cho payment {identifier}")
+
+    def mark_many(self, identifiers, status, txid=None, error=None, extra=None):
+        """Cùng trạng thái cho nhiều payment (các payout trong một giao dịch lô) bằng một lệnh ghi."""
+        with self._lock:
+            for identifier in identifiers:
+                payment = self._payments.get(identifier)
+                if payment is not None:
+                    payment.update(extra or {}, status=status)
+                    if txid:
+                        payment["txid"] = txid
+                    if status in FINAL_STATUSES:
+                        del self._payments[identifier]
+        if self.persist and not self._db.update_many_payment_status(
+            identifiers, status, txid, error=error, extra=extra,
+            buffered=status in BUFFERED_STATUSES
+        ):
+            raise RuntimeError(f"❌ Không thể lưu trạng thái {status} cho {len(identifiers)} payment")
+
+    def stale(self, idle_seconds):
+        if self.persist:
+            return self._db.find_stale_payments(UNFINISHED_STATUSES, idle_seconds)
+        return []
+
+    def claim(self, identifier, lease_seconds):
+        if not self.persist:
+            return True
+        return self._db.claim_payment(identifier, lease_seconds) is not None
@@ -1,6 +1,618 @@
 import requests
+import fcntl
 import json
+import os
+import queue
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import stellar_sdk as s_sdk
+from payment_store import PaymentStore
+from cache import TTLCache
+from metrics import stage, upstream, record_horizon_error
+
+GMOP_ASSET_CODE = "GMOP"
+GMOP_ISSUER = "GDUIGY53ZJYDLFIJC43CGKABUJWJDAOC5JQMZWW2I7AVUDL5X5ZKXFM7"
+
+
+@lru_cache(maxsize=None)
+def shared_asset(code=None, issuer=None):
+    """Asset dùng chung (parse issuer một lần); không truyền code → Pi native."""
+    return s_sdk.Asset(code, issuer) if code else s_sdk.Asset.native()
+
+
+NATIVE_ASSET = shared_asset()
+GMOP_ASSET = shared_asset(GMOP_ASSET_CODE, GMOP_ISSUER)
+
+
+class TransactionRejected(Exception):
+    """Core từ chối giao dịch gửi qua /transactions_async (giao dịch chưa được áp dụng)."""
+
+    def __init__(self, tx_status, code=None, result_codes=None):
+        result_codes = result_codes or {"transaction": code or tx_status.lower()}
+        code = result_codes.get("inner_transaction") or result_codes["transaction"]
+        super().__init__(f"❌ Horizon từ chối giao dịch: {tx_status} {code}".strip())
+        self.tx_status = tx_status
+        self.extras = {"result_codes": result_codes}
+
+
+def _result_code(prefix, code):
+    # txBAD_SEQ → tx_bad_seq, opBAD_AUTH → op_bad_auth
+    return prefix + code.name[2:].lower()
+
+
+def _operation_code(result):
+    if result.code != s_sdk.xdr.OperationResultCode.opINNER:
+        return _result_code("op_", result.code)
+    # Kết quả theo loại op: PAYMENT_NO_DESTINATION → op_no_destination (như Horizon)
+    tr = result.tr
+    op_type = tr.type.name + "_"
+    for key, value in vars(tr).items():
+        if key != "type" and value is not None and hasattr(value, "code"):
+            name = value.code.name
+            return "op_" + (name[len(op_type):] if name.startswith(op_type) else name).lower()
+    return "op_inner"
+
+
+def decode_result_codes(result_xdr):
+    """TransactionResult XDR → result_codes kiểu Horizon; fee-bump thì kèm mã inner_transaction và op của giao dịch bên trong."""
+    result = s_sdk.xdr.TransactionResult.from_xdr(result_xdr).result
+    codes = {"transaction": _result_code("tx_", result.code)}
+    results = result.results
+    if result.inner_result_pair is not None:
+        inner = result.inner_result_pair.result.result
+        codes["inner_transaction"] = _result_code("tx_", inner.code)
+        results = inner.results
+    if results:
+        codes["operations"] = [_operation_code(r) for r in results]
+    return codes
+
+
+def accepted_transaction(response):
+    """Body /transactions_async → {"id", "pending"} khi core đã nhận (PENDING/DUPLICATE), ngược lại TransactionRejected."""
+    tx_status = response.get("tx_status")
+    if tx_status in ("PENDING", "DUPLICATE"):
+        return {"id": response["hash"], "pending": True}
+
+    result_codes = None
+    if response.get("error_result_xdr"):
+        result_codes = decode_result_codes(response["error_result_xdr"])
+    raise TransactionRejected(tx_status or "ERROR", result_codes=result_codes)
+
+
+def async_submit_response(error):
+    """SDK raise với mọi mã khác 2xx (409 DUPLICATE, 400 ERROR, 503 TRY_AGAIN_LATER) → lấy lại body tx_status."""
+    try:
+        body = json.loads(error.message)
+    except (TypeError, ValueError):
+        return None
+    return body if isinstance(body, dict) and body.get("tx_status") else None
+
+
+# Giao dịch chắc chắn chưa vào core → ký lại với sequence mới
+RETRY_RESULT_CODES = ("tx_bad_seq", "try_again_later")
+
+
+def transaction_result_code(error):
+    """Mã lỗi cấp giao dịch Horizon (tx_bad_seq, tx_failed, ...) từ BadRequestError.
+
+    Giao dịch qua channel là fee-bump: Horizon trả tx_fee_bump_inner_failed, mã thật nằm ở inner_transaction.
+    """
+    extras = getattr(error, "extras", None) or {}
+    codes = extras.get("result_codes") or {}
+    return codes.get("inner_transaction") or codes.get("transaction")
+
+
+def operation_result_codes(error):
+    """Mã lỗi từng op (op_no_destination, op_no_trust, ...) theo thứ tự op trong giao dịch (bên trong, nếu là fee-bump)."""
+    extras = getattr(error, "extras", None) or {}
+    return (extras.get("result_codes") or {}).get("operations") or []
+
+
+def resolve_endpoints(env, horizon_url=None, base_url=None):
+    """Trả về (base_url, horizon_url, network); có thể ghi đè URL để chạy với server giả lập."""
+    # Pi API luôn mainnet
+    base_url = base_url or "https://api.minepi.com"
+
+    # Horizon URL
+    if env == "mainnet":
+        horizon_url = horizon_url or "https://api.minepi.com"
+        network = "Pi Network"
+    else:
+        horizon_url = horizon_url or "https://api.testnet.minepi.com"
+        network = "Pi Testnet"
+    return base_url, horizon_url, network
+
+
+# ------------------------------
+#  HTTP client cho Pi Platform API
+# ------------------------------
+class PiApiError(Exception):
+    def __init__(self, status_code, text):
+        super().__init__(f"❌ Pi API {status_code}: {text}")
+        self.status_code = status_code
+        self.text = text
+
+
+class PiApiClient:
+    """Session keep-alive dùng chung trong mỗi worker, có timeout và retry cho các lệnh GET."""
+
+    def __init__(self, base_url, api_key, connect_timeout=3.05, read_timeout=15,
+                 retries=3, backoff=0.3, pool_size=20):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        # Session không an toàn qua fork → mỗi process gunicorn tạo session riêng
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._session = self._new_session()
+                    self._pid = os.getpid()
+        return self._session
+
+    def _new_session(self):
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=self.backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),  # POST approve/complete không tự retry
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def server_headers(self):
+        return {
+            "Authorization": f"Key {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+    def request(self, method, path, operation, headers=None, **kwargs):
+        with upstream("pi_api", operation):
+            res = self.session.request(
+                method,
+                f"{self.base_url}{path}",
+                headers=headers or self.server_headers(),
+                timeout=self.timeout,
+                **kwargs
+            )
+            if res.status_code != 200:
+                raise PiApiError(res.status_code, res.text)
+            return res.json()
+
+    def get_me(self, access_token):
+        return self.request("GET", "/v2/me", "me", headers={"Authorization": f"Bearer {access_token}"})
+
+    def get_user(self, uid):
+        return self.request("GET", f"/v2/users/{uid}", "user")
+
+    def get_payment(self, payment_id):
+        return self.request("GET", f"/v2/payments/{payment_id}", "payment")
+
+    def approve_payment(self, payment_id):
+        return self.request("POST", f"/v2/payments/{payment_id}/approve", "approve", json={})
+
+    def complete_payment(self, payment_id, txid=None):
+        payload = {"txid": txid} if txid else {}
+        return self.request("POST", f"/v2/payments/{payment_id}/complete", "complete", json=payload)
+
+
+# ------------------------------
+#  Quản lý sequence number (dùng chung giữa các worker)
+# ------------------------------
+class AccountBusy(Exception):
+    """Tài khoản nguồn đang được worker khác giữ (hold(blocking=False))."""
+
+
+def sequence_lock_path(lock_dir, account_id):
+    # Dùng chung cho SequenceManager và AsyncSequenceManager → app WSGI và ASGI cùng máy không tranh sequence
+    return os.path.join(lock_dir or tempfile.gettempdir(), f"pi-sequence-{account_id}.lock")
+
+
+class SequenceManager:
+    """Cấp sequence number tại chỗ cho một tài khoản, chỉ resync Horizon khi submit lỗi.
+
+    Mọi thread và mọi worker gunicorn trên máy giữ tài khoản qua `hold()` (flock trên một file theo account id);
+    sequence đã cấp được ghi lại vào file đó nên worker sau tiếp tục đúng thứ tự thay vì tx_bad_seq.
+    """
+
+    def __init__(self, server, account_id, lock_dir=None):
+        self.server = server
+        self.account_id = account_id
+        self.path = sequence_lock_path(lock_dir, account_id)
+        self._sequence = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with upstream("horizon", "load_account"):
+            return self.server.load_account(self.account_id)
+
+    @contextmanager
+    def hold(self, blocking=True):
+        if not self._lock.acquire(blocking):
+            raise AccountBusy(self.account_id)
+        try:
+            with open(self.path, "a+") as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise AccountBusy(self.account_id)
+                f.seek(0)
+                stored = f.read().strip()
+                self._sequence = int(stored) if stored else None
+                try:
+                    yield self
+                finally:
+                    f.seek(0)
+                    f.truncate()
+                    f.write("" if self._sequence is None else str(self._sequence))
+                    f.flush()
+        finally:
+            self._lock.release()
+
+    def prime(self, account):
+        # Warm-up: chỉ nạp khi chưa có, không ghi đè sequence đã cấp cho submit đang chạy
+        with self.hold():
+            if self._sequence is None:
+                self._sequence = account.sequence
+
+    def reserve(self):
+        # Gọi trong hold(). Trả về Account với sequence hiện tại; TransactionBuilder sẽ dùng sequence + 1
+        if self._sequence is None:
+            self._sequence = self._load().sequence
+        sequence = self._sequence
+        self._sequence += 1
+        return s_sdk.Account(self.account_id, sequence)
+
+    def invalidate(self):
+        # Submit lỗi → lần reserve sau (ở bất kỳ worker nào) sẽ load lại từ Horizon
+        self._sequence = None
+
+
+# ------------------------------
+#  Pool channel account
+# ------------------------------
+class Channel:
+    def __init__(self, keypair, sequence):
+        self.keypair = keypair
+        self.sequence = sequence
+
+
+class ChannelPool:
+    """Mỗi channel ký một giao dịch tại một thời điểm (kể cả giữa các worker); app account vẫn là nguồn payment và phí."""
+
+    def __init__(self, server, channel_secrets, lock_dir=None):
+        self._channels = queue.Queue()
+        for secret in channel_secrets:
+            keypair = s_sdk.Keypair.from_secret(secret)
+            self._channels.put(Channel(keypair, SequenceManager(server, keypair.public_key, lock_dir)))
+        self.size = self._channels.qsize()
+
+    @contextmanager
+    def acquire(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        busy = 0
+        while True:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            try:
+                channel = self._channels.get(timeout=remaining)
+            except queue.Empty:
+                raise TimeoutError("❌ Không còn channel account rảnh!")
+            try:
+                with channel.sequence.hold(blocking=False):
+                    yield channel
+                return
+            except AccountBusy:
+                # Worker khác đang dùng channel này → thử channel kế tiếp
+                busy += 1
+            finally:
+                self._channels.put(channel)
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError("❌ Không còn channel account rảnh!")
+            if busy >= self.size:
+                busy = 0
+                time.sleep(0.01)
+
+
+# ------------------------------
+#  Fee oracle theo fee_stats Horizon
+# ------------------------------
+class FeeOracle:
+    """Làm mới fee_stats định kỳ, chọn phí theo percentile (percentile cao hơn khi mạng đông), có trần `max_fee`."""
+
+    def __init__(self, server, base_fee, percentile="p70", surge_percentile="p95",
+                 surge_usage=0.8, max_fee=1000000, interval=30):
+        self.server = server
+        self.base_fee = base_fee
+        self.percentile = percentile
+        self.surge_percentile = surge_percentile
+        self.surge_usage = surge_usage
+        self.max_fee = max_fee
+        self.interval = interval
+        self._fee = base_fee
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        # Thread không sống qua fork → mỗi worker tự khởi động lại (một lần, kể cả khi nhiều thread cùng gọi)
+        if self.interval and self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    threading.Thread(target=self._run, daemon=True).start()
+        return self._fee
+
+    def _run(self):
+        while True:
+            self.refresh()
+            time.sleep(self.interval)
+
+    def refresh(self):
+        try:
+            with upstream("horizon", "fee_stats"):
+                stats = self.server.fee_stats().call()
+            usage = float(stats.get("ledger_capacity_usage") or 0)
+            key = self.surge_percentile if usage >= self.surge_usage else self.percentile
+            fee = max(int(stats["last_ledger_base_fee"]), int(stats["fee_charged"][key]))
+            self._fee = min(max(fee, self.base_fee), self.max_fee)
+        except Exception as e:
+            print(f"❌ Không lấy được fee_stats: {e}")
+        return self._fee
+
+    def bump_fee(self, previous_fee):
+        # Core chỉ thay giao dịch đang chờ khi phí mới gấp ≥ 10 lần
+        return min(max(self._fee, previous_fee * 10), self.max_fee)
+
+
+def fee_bump_envelope(envelope, fee_source, fee_oracle, network):
+    """Bọc lại đúng giao dịch đã ký (cùng sequence) bằng fee-bump phí cao hơn; None nếu không tăng được."""
+    if isinstance(envelope, s_sdk.FeeBumpTransactionEnvelope):
+        inner = envelope.transaction.inner_transaction_envelope
+        previous_fee = envelope.transaction.fee // (len(inner.transaction.operations) + 1)
+    else:
+        inner = envelope
+        previous_fee = inner.transaction.fee // len(inner.transaction.operations)
+
+    if fee_oracle is None:
+        return None
+    base_fee = fee_oracle.bump_fee(previous_fee)
+    if base_fee <= previous_fee:
+        return None
+
+    bumped = s_sdk.TransactionBuilder.build_fee_bump_transaction(
+        fee_source=fee_source,
+        base_fee=base_fee,
+        inner_transaction_envelope=inner,
+        network_passphrase=network,
+    )
+    bumped.sign(fee_source)
+    return bumped
+
+
+def inner_transaction_hash(envelope):
+    # Không đổi qua các lần fee-bump; Horizon tra theo hash này thấy được bản nào lên chain
+    if isinstance(envelope, s_sdk.FeeBumpTransactionEnvelope):
+        return envelope.transaction.inner_transaction_envelope.hash_hex()
+    return envelope.hash_hex()
+
+
+# ------------------------------
+#  Kiểm tra ví nhận trước khi ký
+# ------------------------------
+# Op lỗi do trạng thái ví nhận → bản cache của ví đó đã sai
+DESTINATION_OP_ERRORS = ("op_no_destination", "op_no_trust", "op_not_authorized")
+
+
+class InvalidDestination(ValueError):
+    def __init__(self, destination, code, message):
+        super().__init__(message)
+        self.destination = destination
+        self.code = code
+
+
+class DestinationValidator:
+    """StrKey/checksum, tài khoản đã kích hoạt và trustline của asset; trạng thái ví cache TTL theo account id."""
+
+    def __init__(self, server, ttl=300, negative_ttl=30, maxsize=10000, workers=16):
+        self.server = server
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="destination")
+        # Tài khoản chưa tồn tại cũng cache (ngắn hạn) → payout lặp lại tới ví đó không gọi Horizon
+        self._accounts = TTLCache(
+            maxsize=maxsize,
+            ttl=ttl,
+            negative_ttl=negative_ttl,
+            cache_error=lambda e: isinstance(e, s_sdk.exceptions.NotFoundError)
+        )
+
+    def _trustlines(self, destination):
+        def load():
+            with upstream("horizon", "destination_account"):
+                record = self.server.accounts().account_id(destination).call()
+            # Chỉ credit asset có trustline; native / liquidity_pool_shares không có asset_code
+            return {
+                (b.get("asset_code"), b.get("asset_issuer"))
+                for b in record.get("balances", [])
+                if b.get("asset_type") in ("credit_alphanum4", "credit_alphanum12") and b.get("is_authorized", True)
+            }
+
+        return self._accounts.get_or_load(destination, load)
+
+    def check(self, destination, asset=None):
+        asset = asset or NATIVE_ASSET
+        if not destination or not s_sdk.StrKey.is_valid_ed25519_public_key(destination):
+            raise InvalidDestination(destination, "invalid_address", f"❌ Địa chỉ ví không hợp lệ: {destination}")
+
+        try:
+            trustlines = self._trustlines(destination)
+        except s_sdk.exceptions.NotFoundError:
+            raise InvalidDestination(destination, "op_no_destination", f"❌ Ví {destination} chưa được kích hoạt")
+        except Exception as e:
+            # Horizon lỗi tạm thời → không chặn payout, để submit quyết định
+            print(f"❌ Không kiểm tra được ví {destination}: {e}")
+            return
+
+        if not asset.is_native() and (asset.code, asset.issuer) not in trustlines:
+            raise InvalidDestination(
+                destination,
+                "op_no_trust",
+                f"❌ Ví {destination} chưa bật tài sản {asset.code}, không thể nhận token"
+            )
+
+    def check_many(self, destinations):
+        """destinations: list (destination, asset). Kiểm tra song song, trả về list lỗi InvalidDestination | None theo thứ tự."""
+        def check(item):
+            try:
+                self.check(*item)
+            except InvalidDestination as e:
+                return e
+            return None
+
+        return list(self._executor.map(check, destinations))
+
+    def invalidate(self, destination):
+        self._accounts.invalidate(destination)
+
+    def invalidate_failed(self, payments, error):
+        """Submit lỗi → xoá cache của các ví nhận làm op lỗi (không rõ op nào thì xoá cả giao dịch)."""
+        op_codes = operation_result_codes(error)
+        if len(op_codes) == len(payments):
+            for (destination, *_), code in zip(payments, op_codes):
+                if code in DESTINATION_OP_ERRORS:
+                    self.invalidate(destination)
+        elif transaction_result_code(error) == "tx_failed":
+            for destination, *_ in payments:
+                self.invalidate(destination)
+
+
+# ------------------------------
+#  Gom nhiều payout vào một giao dịch
+# ------------------------------
+class PayoutBatcher:
+    """Gom payout đang chờ thành giao dịch tối đa `max_ops` payment op, flush theo số lượng hoặc theo `window` giây."""
+
+    def __init__(self, pi, max_ops=100, window=0.5):
+        self.pi = pi
+        self.max_ops = max_ops
+        self.window = window
+        self._pending = []
+        self._cond = threading.Condition()
+        self._thread = None
+        workers = pi.channels.size if pi.channels else 1
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def submit(self, destination, amount, asset, payment_id=None):
+        """payment_id: bản ghi trong payment store được cập nhật submitting → completed | failed theo kết quả."""
+        future = Future()
+        with self._cond:
+            self._pending.append((destination, amount, asset, payment_id, future))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                deadline = time.monotonic() + self.window
+                while len(self._pending) < self.max_ops:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[:self.max_ops]
+                del self._pending[:self.max_ops]
+            self._executor.submit(self._send, batch)
+
+    def _send(self, batch):
+        ids = [payment_id for _, _, _, payment_id, _ in batch if payment_id]
+
+        def on_signed(envelope):
+            # Lưu hash trước khi submit để reconcile biết giao dịch đã lên chain hay chưa
+            # (hash bên trong: fee-bump lại đổi hash ngoài nhưng Horizon vẫn tra được theo hash này)
+            if ids:
+                self.pi.open_payments.mark_many(ids, "submitting", extra={"tx_hash": inner_transaction_hash(envelope)})
+
+        try:
+            txid = self.pi._submit_payments(
+                [(destination, amount, asset) for destination, amount, asset, _, _ in batch],
+                on_signed=on_signed
+            )
+        except Exception as e:
+            # Chỉ tx_failed mới do từng op (qua channel: mã inner của fee-bump);
+            # lỗi cấp giao dịch (tx_insufficient_balance, tx_bad_auth, ...) hỏng cả lô
+            if transaction_result_code(e) == "tx_failed":
+                self._split(batch, e)
+                return
+            for item in batch:
+                self._fail(item, e)
+            return
+
+        try:
+            if ids:
+                self.pi.open_payments.mark_many(ids, "completed", txid)
+        except Exception as e:
+            # Giao dịch đã lên chain, chỉ lỗi ghi trạng thái → reconcile hoàn tất theo tx_hash
+            print(f"❌ Không lưu được trạng thái completed cho {len(ids)} payout: {e}")
+        finally:
+            for *_, future in batch:
+                future.set_result(txid)
+
+    def _fail(self, item, error):
+        destination, _, _, payment_id, future = item
+        try:
+            # Chỉ Horizon từ chối mới chắc chắn chưa chuyển; lỗi khác (timeout, 5xx) để reconcile xử lý
+            if payment_id and isinstance(error, (s_sdk.exceptions.BadRequestError, TransactionRejected, ValueError)):
+                self.pi.open_payments.mark(payment_id, "failed", error=str(error))
+        except Exception as e:
+            # Ghi lỗi thì payment giữ trạng thái cũ cho reconcile; người chờ future vẫn phải được trả lời
+            print(f"❌ Không lưu được trạng thái failed cho {payment_id}: {e}")
+        finally:
+            future.set_exception(error)
+
+    def _split(self, batch, error):
+        if len(batch) == 1:
+            self._fail(batch[0], error)
+            return
+
+        # Horizon trả mã lỗi từng op → loại op hỏng, gửi lại phần còn lại
+        op_codes = operation_result_codes(error)
+        if len(op_codes) == len(batch):
+            good = []
+            for item, code in zip(batch, op_codes):
+                if code == "op_success":
+                    good.append(item)
+                else:
+                    self._fail(item, ValueError(f"❌ Payout tới {item[0]} lỗi: {code}"))
+            if len(good) < len(batch):
+                if good:
+                    self._send(good)
+                return
+
+        # Không xác định được op nào hỏng → chia đôi
+        half = len(batch) // 2
+        self._send(batch[:half])
+        self._send(batch[half:])
+
 
 class PiNetwork:
     def __init__(self):
@@ -12,89 +624,407 @@ class PiNetwork:
         self.env = ""
         self.network = ""
         self.fee = 100000
-        self.open_payments = {}
+        self.open_payments = PaymentStore(persist=False)
+        self.sequence = None
+        self.channels = None
+        self.batcher = None
+        self.api = None
+        self.fee_oracle = None
+        self.confirmations = None
+        self.destinations = None
+        self.warmup_error = None
+        self._ready = threading.Event()
+        self._warmup_lock = threading.Lock()
+        self._warmup_pid = None
 
-    def initialize(self, api_key, wallet_private_key, env="mainnet"):
+    def initialize(self, api_key, wallet_private_key, env="mainnet", channel_secrets=None,
+                   connect_timeout=3.05, read_timeout=15, payment_store=None,
+                   horizon_url=None, base_url=None,
+                   fee_percentile="p70", max_fee=1000000, fee_refresh=30, destination_ttl=300,
+                   sequence_lock_dir=None):
         if not self.validate_private_seed_format(wallet_private_key):
             raise ValueError("❌ APP_PRIVATE_KEY không hợp lệ!")
 
         self.api_key = api_key
         self.env = env.lower()
+        if payment_store is not None:
+            self.open_payments = payment_store
 
-        # Pi API luôn mainnet
-        self.base_url = "https://api.minepi.com"
-
-        # Horizon URL
-        if self.env == "mainnet":
-            horizon_url = "https://api.minepi.com"
-            self.network = "Pi Network"
-        else:
-            horizon_url = "https://api.testnet.minepi.com"
-            self.network = "Pi Testnet"
+        self.base_url, horizon_url, self.network = resolve_endpoints(self.env, horizon_url, base_url)
+        self.api = PiApiClient(
+            self.base_url,
+            api_key,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout
+        )
 
-        # Load keypair & account
+        # Parse keypair / channel một lần; không gọi Horizon ở đây (xem warm_up)
         self.keypair = s_sdk.Keypair.from_secret(wallet_private_key)
         self.server = s_sdk.Server(horizon_url=horizon_url)
+        if sequence_lock_dir:
+            # Thư mục lock chưa có → mọi payout (kể cả warm-up) lỗi FileNotFoundError
+            os.makedirs(sequence_lock_dir, exist_ok=True)
+        self.sequence = SequenceManager(self.server, self.keypair.public_key, sequence_lock_dir)
 
-        try:
+        self.destinations = DestinationValidator(self.server, ttl=destination_ttl)
+
+        if channel_secrets:
+            self.channels = ChannelPool(self.server, channel_secrets, sequence_lock_dir)
+            print(f"✅ Channel pool: {self.channels.size} account")
+
+        # fee_refresh=None → giữ phí cố định, chỉ dùng oracle để fee-bump
+        self.fee_oracle = FeeOracle(
+            self.server,
+            self.fee,
+            percentile=fee_percentile,
+            max_fee=max_fee,
+            interval=fee_refresh
+        )
+
+    # ------------------------------
+    #   Warm-up nền & readiness
+    # ------------------------------
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def warm_up(self):
+        """Load app account + base fee từ Horizon. Submit vẫn chạy được khi chưa warm (sequence tự load)."""
+        with upstream("horizon", "load_account"):
             self.account = self.server.load_account(self.keypair.public_key)
-            print(f"✅ Loaded account: {self.keypair.public_key}")
-        except Exception as e:
-            print(f"❌ Không thể load tài khoản: {e}")
-            self.account = None
+        self.sequence.prime(self.account)
+
+        with upstream("horizon", "fetch_base_fee"):
+            self.fee = self.server.fetch_base_fee()
+        self.fee_oracle.base_fee = self.fee
+        self.fee_oracle.current()
 
-        self.fee = self.server.fetch_base_fee()
+        self.warmup_error = None
+        self._ready.set()
+        print(f"✅ Loaded account: {self.keypair.public_key}")
+
+    def start_warmup(self):
+        # Thread không sống qua fork → gọi sau khi fork (post_worker_init), mỗi process một lần
+        with self._warmup_lock:
+            if self._warmup_pid == os.getpid():
+                return
+            self._warmup_pid = os.getpid()
+        threading.Thread(target=self._warmup_loop, daemon=True).start()
+
+    def _warmup_loop(self):
+        backoff = 1
+        while not self._ready.is_set():
+            try:
+                self.warm_up()
+            except Exception as e:
+                self.warmup_error = str(e)
+                print(f"❌ Không thể load tài khoản, thử lại sau {backoff}s: {e}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
 
     def get_http_headers(self):
-        return {
-            "Authorization": f"Key {self.api_key}",
-            "Content-Type": "application/json"
-        }
+        return self.api.server_headers()
 
     def validate_private_seed_format(self, seed):
         return seed.upper().startswith("S") and len(seed) == 56
 
+    @contextmanager
+    def _transaction_source(self):
+        # Không có channel → ký trực tiếp bằng app account, submit lần lượt
+        # (core từ chối sequence đến sai thứ tự bằng tx_bad_seq)
+        if self.channels is None:
+            with self.sequence.hold():
+                yield self.keypair, self.sequence
+            return
+        with self.channels.acquire() as channel:
+            yield channel.keypair, channel.sequence
+
+    def _base_fee(self):
+        return self.fee_oracle.current() if self.fee_oracle else self.fee
+
+    def _is_stuck(self, error):
+        # Phí thấp, Horizon timeout (504) hoặc mất kết nối → chưa biết giao dịch có lên chain không
+        if transaction_result_code(error) == "tx_insufficient_fee":
+            return True
+        return isinstance(error, (s_sdk.exceptions.BadResponseError, s_sdk.exceptions.ConnectionError))
+
+    def _find_transaction(self, tx_hash):
+        try:
+            with upstream("horizon", "transaction"):
+                return self.server.transactions().transaction(tx_hash).call()
+        except s_sdk.exceptions.NotFoundError:
+            return None
+
+    def _fee_bump(self, envelope):
+        return fee_bump_envelope(envelope, self.keypair, self.fee_oracle, self.network)
+
+    def _submit_envelope(self, envelope):
+        try:
+            with stage("submit"), upstream("horizon", "submit_transaction"):
+                return self.server.submit_transaction(envelope)
+        except Exception as e:
+            record_horizon_error(e)
+            if not self._is_stuck(e):
+                raise
+            error = e
+
+        # Có thể đã lên chain dù request lỗi
+        if transaction_result_code(error) != "tx_insufficient_fee":
+            landed = self._find_transaction(inner_transaction_hash(envelope))
+            if landed is not None:
+                return landed
+
+        bumped = self._fee_bump(envelope)
+        if bumped is None:
+            raise error
+        print(f"⛽ Fee-bump giao dịch {inner_transaction_hash(envelope)[:12]}…, phí {bumped.transaction.fee}")
+        try:
+            with stage("fee_bump"), upstream("horizon", "submit_fee_bump"):
+                return self.server.submit_transaction(bumped)
+        except Exception as e:
+            record_horizon_error(e)
+            raise
+
+    def _submit_bumped(self, envelope, on_signed=None):
+        """Gửi lại qua /transactions_async đúng giao dịch đã ký bằng fee-bump phí cao hơn; None nếu không tăng được."""
+        bumped = self._fee_bump(envelope)
+        if bumped is None:
+            return None
+        # Hash bên trong không đổi, on_signed cập nhật envelope đang theo dõi sang bản fee-bump
+        if on_signed:
+            on_signed(bumped)
+        print(f"⛽ Fee-bump giao dịch {inner_transaction_hash(bumped)[:12]}…, phí {bumped.transaction.fee}")
+        with stage("fee_bump"):
+            return self._submit_accepted(bumped)
+
+    def _submit_accepted(self, envelope):
+        """Gửi qua /transactions_async: trả về ngay khi core nhận giao dịch, chưa chờ ledger đóng."""
+        try:
+            with stage("submit"), upstream("horizon", "submit_transaction_async"):
+                response = self.server.submit_transaction_async(envelope)
+        except s_sdk.exceptions.NotFoundError:
+            # Horizon cũ chưa có /transactions_async → gửi đồng bộ
+            return self._submit_envelope(envelope)
+        except (s_sdk.exceptions.BadRequestError, s_sdk.exceptions.BadResponseError) as e:
+            response = async_submit_response(e)
+            if response is None:
+                record_horizon_error(e)
+                raise
+
+        try:
+            return accepted_transaction(response)
+        except TransactionRejected as e:
+            record_horizon_error(e)
+            raise
+
+    def _submit_payments(self, payments, memo=None, on_signed=None, bad_seq_retries=2, wait=True):
+        """payments: list (destination, amount, asset). Trả về txid.
+
+        wait=False: trả về hash ngay khi core nhận, xác nhận on-chain do ConfirmationTracker theo dõi.
+        """
+        for attempt in range(bad_seq_retries + 1):
+            try:
+                return self._submit_once(payments, memo, on_signed, wait)
+            except (s_sdk.exceptions.BadRequestError, TransactionRejected) as e:
+                # tx_bad_seq / TRY_AGAIN_LATER: giao dịch chưa được áp dụng → resync rồi ký lại là an toàn
+                if attempt == bad_seq_retries or transaction_result_code(e) not in RETRY_RESULT_CODES:
+                    if self.destinations:
+                        self.destinations.invalidate_failed(payments, e)
+                    raise
+                print(f"🔁 {transaction_result_code(e)}, ký lại lần {attempt + 1}")
+
+    def _submit_once(self, payments, memo=None, on_signed=None, wait=True):
+        with self._transaction_source() as (source_keypair, sequence):
+            op_source = None
+            if source_keypair is not self.keypair:
+                op_source = self.keypair.public_key
+
+            with stage("sequence"):
+                source_account = sequence.reserve()
+
+            with stage("build"):
+                base_fee = self._base_fee()
+                builder = s_sdk.TransactionBuilder(
+                    source_account=source_account,
+                    network_passphrase=self.network,
+                    base_fee=base_fee,
+                )
+                if memo:
+                    builder.add_text_memo(memo)
+                for destination, amount, asset in payments:
+                    builder.append_payment_op(
+                        destination=destination,
+                        amount=str(amount),
+                        asset=asset,
+                        source=op_source
+                    )
+                transaction = builder.set_timeout(180).build()
+
+            with stage("sign"):
+                transaction.sign(source_keypair)
+
+                envelope = transaction
+                if op_source:
+                    # Channel chỉ cấp sequence, app account ký payment và trả phí qua fee-bump
+                    transaction.sign(self.keypair)
+                    envelope = s_sdk.TransactionBuilder.build_fee_bump_transaction(
+                        fee_source=self.keypair,
+                        base_fee=base_fee,
+                        inner_transaction_envelope=transaction,
+                        network_passphrase=self.network,
+                    )
+                    envelope.sign(self.keypair)
+
+            try:
+                # Lưu tx_hash lỗi → chưa submit, trả lại sequence
+                if on_signed:
+                    on_signed(envelope)
+                if wait:
+                    response = self._submit_envelope(envelope)
+                else:
+                    try:
+                        response = self._submit_accepted(envelope)
+                    except TransactionRejected as e:
+                        if transaction_result_code(e) != "tx_insufficient_fee":
+                            raise
+                        # Phí thấp hơn mức core đang nhận → fee-bump ngay, vẫn giữ sequence
+                        response = self._submit_bumped(envelope, on_signed)
+                        if response is None:
+                            raise
+            except Exception:
+                sequence.invalidate()
+                raise
+            return response["id"]
+
     # ------------------------------
     #  A2U Native Test-Pi Payment
     # ------------------------------
     def create_payment(self, payment_data):
-        self.open_payments[payment_data["identifier"]] = payment_data
+        self.open_payments.put(payment_data)
         return payment_data["identifier"]
 
-    def submit_payment(self, payment_id, _):
-        payment = self.open_payments[payment_id]
-        account = self.server.load_account(self.keypair.public_key)
+    def submit_payment(self, payment_id, _, wait=True):
+        payment = self.open_payments.get(payment_id)
+        tracker = None if wait else self.confirmations
 
-        transaction = (
-            s_sdk.TransactionBuilder(
-                source_account=account,
-                network_passphrase=self.network,
-                base_fee=self.fee,
-            )
-            .add_text_memo(payment["memo"])
-            .append_payment_op(
-                destination=payment["to_address"],
-                amount=str(payment["amount"]),
-                asset=s_sdk.Asset.native()     # Native Test-Pi
+        try:
+            # Ví nhận chắc chắn lỗi → từ chối trước khi tốn sequence / ký / submit
+            self.check_destination(payment["to_address"])
+        except InvalidDestination as e:
+            self.open_payments.mark(payment_id, "failed", error=str(e))
+            raise
+
+        def on_signed(envelope):
+            # Lưu hash bên trong trước khi submit: reconcile tra được cả bản gốc lẫn bản fee-bump
+            self.open_payments.mark(payment_id, "submitting", extra={"tx_hash": inner_transaction_hash(envelope)})
+            if tracker:
+                tracker.watch(payment_id, envelope, payment["memo"])
+
+        try:
+            txid = self._submit_payments(
+                [(payment["to_address"], payment["amount"], NATIVE_ASSET)],  # Native Test-Pi
+                memo=payment["memo"],
+                on_signed=on_signed,
+                wait=tracker is None
             )
-            .set_timeout(180)
-            .build()
-        )
+        except (s_sdk.exceptions.BadRequestError, TransactionRejected) as e:
+            # Horizon từ chối → chắc chắn chưa chuyển tiền
+            if tracker:
+                tracker.forget(payment_id)
+            self.open_payments.mark(payment_id, "failed", error=str(e))
+            raise
+
+        if tracker:
+            # Core đã nhận, chờ tracker thấy giao dịch trên chain rồi mới complete
+            self.open_payments.mark(payment_id, "accepted", extra={"tx_hash": txid})
+        else:
+            self.open_payments.mark(payment_id, "submitted", txid)
+        return txid
+
+    def check_destination(self, destination, asset=None):
+        if self.destinations:
+            self.destinations.check(destination, asset)
 
-        transaction.sign(self.keypair)
-        response = self.server.submit_transaction(transaction)
-        return response["id"]
+    def pay(self, payment_id):
+        """submit + complete. Có ConfirmationTracker thì trả về ngay khi core nhận, complete chạy nền."""
+        if self.confirmations is not None:
+            return self.submit_payment(payment_id, None, wait=False)
+        txid = self.submit_payment(payment_id, None)
+        self.complete_payment(payment_id, txid)
+        return txid
 
     def complete_payment(self, identifier, txid=None):
-        url = f"{self.base_url}/v2/payments/{identifier}/complete"
-        payload = {"txid": txid} if txid else {}
-        res = requests.post(url, headers=self.get_http_headers(), json=payload)
-        return res.json()
+        with stage("complete"):
+            result = self.api.complete_payment(identifier, txid)
+        self.open_payments.mark(identifier, "completed", txid)
+        return result
 
     def approve_payment(self, payment_id):
-        url = f"{self.base_url}/v2/payments/{payment_id}/approve"
-        res = requests.post(url, headers=self.get_http_headers(), json={})
-        return res.json()
+        return self.api.approve_payment(payment_id)
+
+    # ------------------------------
+    #  Reconcile payment dở dang sau restart
+    # ------------------------------
+    def reconcile_payments(self, idle_seconds=300, lease_seconds=300, resolve_wallet=None):
+        """resolve_wallet(uid): lấy ví cho job xếp hàng chưa có to_address (như PayoutQueue)."""
+        # idle_seconds > timeout giao dịch (180s) → tx chưa thấy trên chain thì sẽ không bao giờ lên
+        for payment in self.open_payments.stale(idle_seconds):
+            identifier = payment["payment_id"]
+            if not self.open_payments.claim(identifier, lease_seconds):
+                continue
+            try:
+                self._reconcile_payment(payment, resolve_wallet)
+            except Exception as e:
+                print(f"❌ Reconcile {identifier} lỗi: {e}")
+
+    def _reconcile_payment(self, payment, resolve_wallet=None):
+        identifier = payment["payment_id"]
+        txid = payment.get("txid")
+        # Payout lô (/api/a2u-batch): chuyển thẳng trên chain, không có payment Pi để complete
+        transfer = payment.get("kind") == "transfer"
+
+        if not txid and payment.get("tx_hash"):
+            try:
+                with upstream("horizon", "transaction"):
+                    tx = self.server.transactions().transaction(payment["tx_hash"]).call()
+            except s_sdk.exceptions.NotFoundError:
+                tx = None
+            if tx is not None:
+                if not tx.get("successful", True):
+                    self.open_payments.mark(identifier, "failed", error="tx_failed")
+                    return
+                txid = tx["id"]
+                self.open_payments.mark(identifier, "completed" if transfer else "submitted", txid)
+                if transfer:
+                    return
+
+        if transfer:
+            print(f"🔁 Gửi lại payout lô chưa lên chain: {identifier}")
+            asset = shared_asset(payment.get("asset_code"), payment.get("asset_issuer"))
+            self.send_batch([{
+                "destination": payment["to_address"],
+                "amount": payment["amount"],
+                "asset": asset,
+                "payment_id": identifier
+            }])
+            return
+
+        if not txid:
+            if not payment.get("to_address"):
+                if not (resolve_wallet and payment.get("user_uid")):
+                    self.open_payments.mark(identifier, "failed", error="Thiếu địa chỉ ví")
+                    return
+                try:
+                    wallet = resolve_wallet(payment["user_uid"])
+                except LookupError as e:
+                    self.open_payments.mark(identifier, "failed", error=str(e))
+                    return
+                self.open_payments.mark(identifier, payment["status"], extra={"to_address": wallet})
+            print(f"🔁 Gửi lại payment chưa lên chain: {identifier}")
+            txid = self.submit_payment(identifier, None)
+
+        self.complete_payment(identifier, txid)
+        print(f"✅ Reconcile xong {identifier}: {txid}")
 
     # ------------------------------
     #   SEND CUSTOM TOKEN (GMOP)
@@ -102,26 +1032,48 @@ class PiNetwork:
     def send_token(self, asset_code, asset_issuer, amount, destination):
         print(f"🚀 Sending {amount} {asset_code} → {destination}")
 
-        account = self.server.load_account(self.keypair.public_key)
-        asset = s_sdk.Asset(asset_code, asset_issuer)
+        asset = shared_asset(asset_code, asset_issuer)  # GMOP token here
+        self.check_destination(destination, asset)
+        txid = self._submit_payments([(destination, amount, asset)])
 
-        transaction = (
-            s_sdk.TransactionBuilder(
-                source_account=account,
-                network_passphrase=self.network,
-                base_fee=self.fee
-            )
-            .append_payment_op(
-                destination=destination,
-                amount=str(amount),
-                asset=asset  # GMOP token here
-            )
-            .set_timeout(180)
-            .build()
-        )
+        print("✅ Token transfer TX:", txid)
+        return txid
+
+    # ------------------------------
+    #   BATCH PAYOUT (Pi / token)
+    # ------------------------------
+    def send_batch(self, payouts, timeout=300):
+        """payouts: list dict {destination, amount, asset, payment_id?}. Trả về list {success, txid | message} theo thứ tự.
+
+        timeout: giây chờ cả lô; payout chưa xong khi hết hạn giữ trạng thái hiện tại cho reconcile.
+        """
+        if self.batcher is None:
+            self.batcher = PayoutBatcher(self)
+
+        # Ví chưa cache thì mỗi ví một lượt Horizon → kiểm tra song song thay vì lần lượt
+        if self.destinations:
+            errors = self.destinations.check_many([(p["destination"], p["asset"]) for p in payouts])
+        else:
+            errors = [None] * len(payouts)
 
-        transaction.sign(self.keypair)
-        response = self.server.submit_transaction(transaction)
+        futures = []
+        for p, e in zip(payouts, errors):
+            if e is not None:
+                if p.get("payment_id"):
+                    self.open_payments.mark(p["payment_id"], "failed", error=str(e))
+                future = Future()
+                future.set_exception(e)
+            else:
+                future = self.batcher.submit(p["destination"], p["amount"], p["asset"], p.get("payment_id"))
+            futures.append(future)
 
-        print("✅ Token transfer TX:", response)
-        return response["id"]
+        results = []
+        deadline = time.monotonic() + timeout
+        for future in futures:
+            try:
+                results.append({"success": True, "txid": future.result(max(0, deadline - time.monotonic()))})
+            except FutureTimeoutError:
+                results.append({"success": False, "message": f"❌ Payout chưa xong sau {timeout}s, sẽ được reconcile"})
+            except Exception as e:
+                results.append({"success": False, "message": str(e)})
+        return results
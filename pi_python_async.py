@@ -0,0 +1,658 @@
+import asyncio
+import fcntl
+import os
+import time
+from contextlib import asynccontextmanager
+import aiohttp
+import stellar_sdk as s_sdk
+from stellar_sdk.client.aiohttp_client import AiohttpClient
+from payment_store import PaymentStore
+from pi_python import (
+    PiApiError, AccountBusy, Channel, DestinationValidator, FeeOracle, InvalidDestination, TransactionRejected,
+    NATIVE_ASSET, RETRY_RESULT_CODES, accepted_transaction, async_submit_response, decode_result_codes, fee_bump_envelope,
+    inner_transaction_hash, resolve_endpoints, sequence_lock_path, shared_asset, transaction_result_code
+)
+from metrics import stage, upstream, record_horizon_error
+
+
+# ------------------------------
+#  HTTP client async cho Pi Platform API
+# ------------------------------
+class AsyncPiApiClient:
+    """Bản async của PiApiClient: một aiohttp session keep-alive, timeout và retry cho GET."""
+
+    def __init__(self, base_url, api_key, connect_timeout=3.05, read_timeout=15,
+                 retries=3, backoff=0.3, pool_size=100):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self._session = None
+
+    @property
+    def session(self):
+        # Tạo trong event loop đang chạy
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=self.timeout,
+                connector=aiohttp.TCPConnector(limit=self.pool_size)
+            )
+        return self._session
+
+    def server_headers(self):
+        return {
+            "Authorization": f"Key {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+    async def request(self, method, path, operation, headers=None, **kwargs):
+        with upstream("pi_api", operation):
+            return await self._request(method, path, headers, **kwargs)
+
+    async def _request(self, method, path, headers=None, **kwargs):
+        # POST approve/complete không tự retry
+        attempts = self.retries + 1 if method == "GET" else 1
+        for attempt in range(attempts):
+            try:
+                async with self.session.request(
+                    method,
+                    f"{self.base_url}{path}",
+                    headers=headers or self.server_headers(),
+                    **kwargs
+                ) as res:
+                    text = await res.text()
+                    retryable = res.status in (429, 500, 502, 503, 504)
+                    if res.status == 200:
+                        return await res.json(content_type=None)
+                    if not retryable or attempt == attempts - 1:
+                        raise PiApiError(res.status, text)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt == attempts - 1:
+                    raise
+            await asyncio.sleep(self.backoff * (2 ** attempt))
+
+    async def get_me(self, access_token):
+        return await self.request("GET", "/v2/me", "me", headers={"Authorization": f"Bearer {access_token}"})
+
+    async def get_user(self, uid):
+        return await self.request("GET", f"/v2/users/{uid}", "user")
+
+    async def get_payment(self, payment_id):
+        return await self.request("GET", f"/v2/payments/{payment_id}", "payment")
+
+    async def approve_payment(self, payment_id):
+        return await self.request("POST", f"/v2/payments/{payment_id}/approve", "approve", json={})
+
+    async def complete_payment(self, payment_id, txid=None):
+        payload = {"txid": txid} if txid else {}
+        return await self.request("POST", f"/v2/payments/{payment_id}/complete", "complete", json=payload)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+class AsyncSequenceManager:
+    """Bản async của SequenceManager: cùng file lock theo account id, chờ flock trong thread để không chặn event loop."""
+
+    def __init__(self, server, account_id, lock_dir=None):
+        self.server = server
+        self.account_id = account_id
+        self.path = sequence_lock_path(lock_dir, account_id)
+        self._sequence = None
+        self._lock = asyncio.Lock()
+
+    @asynccontextmanager
+    async def hold(self, blocking=True):
+        if not blocking and self._lock.locked():
+            raise AccountBusy(self.account_id)
+        async with self._lock:
+            with open(self.path, "a+") as f:
+                try:
+                    if blocking:
+                        await asyncio.to_thread(fcntl.flock, f, fcntl.LOCK_EX)
+                    else:
+                        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise AccountBusy(self.account_id)
+                f.seek(0)
+                stored = f.read().strip()
+                self._sequence = int(stored) if stored else None
+                try:
+                    yield self
+                finally:
+                    f.seek(0)
+                    f.truncate()
+                    f.write("" if self._sequence is None else str(self._sequence))
+                    f.flush()
+
+    async def prime(self, account):
+        async with self.hold():
+            if self._sequence is None:
+                self._sequence = account.sequence
+
+    async def reserve(self):
+        # Gọi trong hold()
+        if self._sequence is None:
+            with upstream("horizon", "load_account"):
+                self._sequence = (await self.server.load_account(self.account_id)).sequence
+        sequence = self._sequence
+        self._sequence += 1
+        return s_sdk.Account(self.account_id, sequence)
+
+    def invalidate(self):
+        self._sequence = None
+
+
+class AsyncChannelPool:
+    """Bản async của ChannelPool: mỗi channel ký một giao dịch tại một thời điểm, kể cả giữa các worker."""
+
+    def __init__(self, server, channel_secrets, lock_dir=None):
+        self._channels = []
+        for secret in channel_secrets:
+            keypair = s_sdk.Keypair.from_secret(secret)
+            self._channels.append(Channel(keypair, AsyncSequenceManager(server, keypair.public_key, lock_dir)))
+        self.size = len(self._channels)
+        self._next = 0
+
+    @asynccontextmanager
+    async def acquire(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            # Bắt đầu từ channel kế tiếp → chia đều tải giữa các channel
+            start = self._next
+            self._next = (self._next + 1) % self.size
+            for i in range(self.size):
+                channel = self._channels[(start + i) % self.size]
+                try:
+                    async with channel.sequence.hold(blocking=False):
+                        yield channel
+                    return
+                except AccountBusy:
+                    continue
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError("❌ Không còn channel account rảnh!")
+            await asyncio.sleep(0.01)
+
+
+# ------------------------------
+#  Chờ giao dịch lên ledger: một stream Horizon dùng chung cho mọi payout
+# ------------------------------
+class AsyncLedgerWatcher:
+    """Stream giao dịch của app account (như ConfirmationTracker): đánh thức payout đang chờ theo hash
+    thay vì mỗi payout tự poll GET /transactions/{hash}."""
+
+    def __init__(self, server, account_id):
+        self.server = server
+        self.account_id = account_id
+        self.cursor = "now"
+        self._waiters = {}  # tx_hash → Future
+        self._watched = {}  # Future → các hash của nó
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._stream_loop())
+
+    def watch(self, envelope, waiter=None):
+        """Future nhận bản ghi giao dịch khi hash ngoài hoặc hash bên trong xuất hiện trên stream."""
+        self.start()
+        if waiter is None:
+            waiter = asyncio.get_running_loop().create_future()
+        hashes = self._watched.setdefault(waiter, [])
+        for tx_hash in (envelope.hash_hex(), inner_transaction_hash(envelope)):
+            hashes.append(tx_hash)
+            self._waiters[tx_hash] = waiter
+        return waiter
+
+    def forget(self, waiter):
+        for tx_hash in self._watched.pop(waiter, ()):
+            if self._waiters.get(tx_hash) is waiter:
+                del self._waiters[tx_hash]
+
+    async def _stream_loop(self):
+        backoff = 1
+        while True:
+            try:
+                builder = self.server.transactions().for_account(self.account_id).cursor(self.cursor)
+                async for tx in builder.stream():
+                    backoff = 1
+                    self.cursor = tx.get("paging_token", self.cursor)
+                    self._match(tx)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Stream Horizon lỗi, kết nối lại sau {backoff}s (cursor={self.cursor}): {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def _match(self, tx):
+        for tx_hash in (tx.get("hash"), (tx.get("inner_transaction") or {}).get("hash")):
+            waiter = self._waiters.get(tx_hash)
+            if waiter is not None:
+                if not waiter.done():
+                    waiter.set_result(tx)
+                return
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+
+
+# ------------------------------
+#  PiNetwork async (ASGI)
+# ------------------------------
+class AsyncPiNetwork:
+    def __init__(self):
+        self.api_key = ""
+        self.keypair = None
+        self.server = None
+        self.account = None
+        self.base_url = ""
+        self.env = ""
+        self.network = ""
+        self.fee = 100000
+        self.open_payments = PaymentStore(persist=False)
+        self.sequence = None
+        self.channels = None
+        self.api = None
+        self.fee_oracle = None
+        self.destinations = None
+        self.ledger = None
+        self._warmup_task = None
+        self.warmup_error = None
+
+    async def initialize(self, api_key, wallet_private_key, env="mainnet", channel_secrets=None,
+                         connect_timeout=3.05, read_timeout=15, payment_store=None,
+                         horizon_url=None, base_url=None, pool_size=100, destination_ttl=300,
+                         sequence_lock_dir=None, bump_after=20,
+                         fee_percentile="p70", max_fee=1000000, fee_refresh=30):
+        if not self.validate_private_seed_format(wallet_private_key):
+            raise ValueError("❌ APP_PRIVATE_KEY không hợp lệ!")
+
+        self.api_key = api_key
+        self.env = env.lower()
+        if payment_store is not None:
+            self.open_payments = payment_store
+
+        self.base_url, horizon_url, self.network = resolve_endpoints(self.env, horizon_url, base_url)
+        self.api = AsyncPiApiClient(
+            self.base_url,
+            api_key,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            pool_size=pool_size
+        )
+
+        self.keypair = s_sdk.Keypair.from_secret(wallet_private_key)
+        self.server = s_sdk.ServerAsync(
+            horizon_url=horizon_url,
+            client=AiohttpClient(pool_size=pool_size)
+        )
+        if sequence_lock_dir:
+            # Thư mục lock chưa có → mọi payout (kể cả warm-up) lỗi FileNotFoundError
+            os.makedirs(sequence_lock_dir, exist_ok=True)
+        self.sequence = AsyncSequenceManager(self.server, self.keypair.public_key, sequence_lock_dir)
+        self.ledger = AsyncLedgerWatcher(self.server, self.keypair.public_key)
+        if channel_secrets:
+            self.channels = AsyncChannelPool(self.server, channel_secrets, sequence_lock_dir)
+            print(f"✅ Channel pool: {self.channels.size} account")
+        # Validator và fee oracle dùng client đồng bộ của pi_python, chạy trong thread
+        sync_server = s_sdk.Server(horizon_url=horizon_url)
+        self.destinations = DestinationValidator(sync_server, ttl=destination_ttl)
+        # fee_refresh=None → giữ phí cố định, chỉ dùng oracle để fee-bump
+        self.fee_oracle = FeeOracle(
+            sync_server,
+            self.fee,
+            percentile=fee_percentile,
+            max_fee=max_fee,
+            interval=fee_refresh
+        )
+        self.bump_after = bump_after
+
+        # Load account / base fee chạy nền, không chặn before_serving
+        self._warmup_task = asyncio.create_task(self._warmup_loop())
+        # Mở stream sẵn → payout đầu tiên không lỡ giao dịch lên chain trong lúc kết nối
+        self.ledger.start()
+
+    @property
+    def ready(self):
+        return self._warmup_task is not None and self._warmup_task.done()
+
+    async def warm_up(self):
+        with upstream("horizon", "load_account"):
+            self.account = await self.server.load_account(self.keypair.public_key)
+        await self.sequence.prime(self.account)
+
+        with upstream("horizon", "fetch_base_fee"):
+            self.fee = await self.server.fetch_base_fee()
+        self.fee_oracle.base_fee = self.fee
+        self.fee_oracle.current()
+
+        self.warmup_error = None
+        print(f"✅ Loaded account: {self.keypair.public_key}")
+
+    async def _warmup_loop(self):
+        backoff = 1
+        while True:
+            try:
+                return await self.warm_up()
+            except Exception as e:
+                self.warmup_error = str(e)
+                print(f"❌ Không thể load tài khoản, thử lại sau {backoff}s: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    async def close(self):
+        if self._warmup_task is not None:
+            self._warmup_task.cancel()
+        if self.ledger is not None:
+            self.ledger.close()
+        await self.api.close()
+        await self.server.close()
+
+    def get_http_headers(self):
+        return self.api.server_headers()
+
+    def validate_private_seed_format(self, seed):
+        return seed.upper().startswith("S") and len(seed) == 56
+
+    async def _store(self, method, *args, **kwargs):
+        # Store ghi Mongo là blocking → chạy trong thread
+        fn = getattr(self.open_payments, method)
+        if self.open_payments.persist:
+            return await asyncio.to_thread(fn, *args, **kwargs)
+        return fn(*args, **kwargs)
+
+    async def _submit_payments(self, payments, memo=None, on_signed=None, bad_seq_retries=2):
+        """payments: list (destination, amount, asset). Trả về txid."""
+        try:
+            for attempt in range(bad_seq_retries + 1):
+                try:
+                    envelope, response = await self._submit_once(payments, memo, on_signed)
+                    break
+                except (s_sdk.exceptions.BadRequestError, TransactionRejected) as e:
+                    if attempt == bad_seq_retries or transaction_result_code(e) not in RETRY_RESULT_CODES:
+                        raise
+                    print(f"🔁 {transaction_result_code(e)}, ký lại lần {attempt + 1}")
+
+            if response.get("pending"):
+                # Chờ ledger ngoài lock → các payout đồng thời cùng vào một ledger
+                return await self._wait_for_ledger(envelope, on_signed)
+            return response["id"]
+        except (s_sdk.exceptions.BadRequestError, TransactionRejected) as e:
+            self.destinations.invalidate_failed(payments, e)
+            raise
+
+    @asynccontextmanager
+    async def _transaction_source(self):
+        # Không có channel → mọi giao dịch xếp hàng trên sequence của app account
+        if self.channels is None:
+            async with self.sequence.hold():
+                yield self.keypair, self.sequence
+            return
+        async with self.channels.acquire() as channel:
+            yield channel.keypair, channel.sequence
+
+    async def _submit_once(self, payments, memo=None, on_signed=None):
+        """Chỉ giữ sequence trong lúc ký và gửi qua /transactions_async (core nhận theo đúng thứ tự sequence)."""
+        async with self._transaction_source() as (source_keypair, sequence):
+            op_source = None
+            if source_keypair is not self.keypair:
+                op_source = self.keypair.public_key
+
+            with stage("sequence"):
+                source_account = await sequence.reserve()
+
+            with stage("build"):
+                base_fee = self._base_fee()
+                builder = s_sdk.TransactionBuilder(
+                    source_account=source_account,
+                    network_passphrase=self.network,
+                    base_fee=base_fee,
+                )
+                if memo:
+                    builder.add_text_memo(memo)
+                for destination, amount, asset in payments:
+                    builder.append_payment_op(
+                        destination=destination,
+                        amount=str(amount),
+                        asset=asset,
+                        source=op_source
+                    )
+                transaction = builder.set_timeout(180).build()
+
+            with stage("sign"):
+                transaction.sign(source_keypair)
+
+                envelope = transaction
+                if op_source:
+                    # Channel chỉ cấp sequence, app account ký payment và trả phí qua fee-bump
+                    transaction.sign(self.keypair)
+                    envelope = s_sdk.TransactionBuilder.build_fee_bump_transaction(
+                        fee_source=self.keypair,
+                        base_fee=base_fee,
+                        inner_transaction_envelope=transaction,
+                        network_passphrase=self.network,
+                    )
+                    envelope.sign(self.keypair)
+
+            try:
+                # Lưu tx_hash lỗi → chưa submit, trả lại sequence
+                if on_signed:
+                    await on_signed(inner_transaction_hash(envelope))
+                try:
+                    return envelope, await self._submit_accepted(envelope)
+                except TransactionRejected as e:
+                    if transaction_result_code(e) != "tx_insufficient_fee":
+                        raise
+                    # Phí thấp hơn mức core đang nhận → fee-bump ngay, vẫn giữ sequence
+                    bumped = await self._submit_bumped(envelope, on_signed)
+                    if bumped is None:
+                        raise
+                    return bumped
+            except Exception:
+                sequence.invalidate()
+                raise
+
+    def _base_fee(self):
+        return self.fee_oracle.current() if self.fee_oracle else self.fee
+
+    async def _submit_bumped(self, envelope, on_signed=None):
+        """Gửi lại đúng giao dịch đã ký bằng fee-bump phí cao hơn; (envelope, response) hoặc None nếu không tăng được."""
+        bumped = fee_bump_envelope(envelope, self.keypair, self.fee_oracle, self.network)
+        if bumped is None:
+            return None
+        # Lưu hash bên trong trước khi gửi → reconcile tra được bản nào (gốc hay fee-bump) lên chain
+        if on_signed:
+            await on_signed(inner_transaction_hash(bumped))
+        print(f"⛽ Fee-bump giao dịch {inner_transaction_hash(bumped)[:12]}…, phí {bumped.transaction.fee}")
+        with stage("fee_bump"):
+            return bumped, await self._submit_accepted(bumped)
+
+    async def _submit_accepted(self, envelope):
+        try:
+            with stage("submit"), upstream("horizon", "submit_transaction_async"):
+                response = await self.server.submit_transaction_async(envelope)
+        except s_sdk.exceptions.NotFoundError:
+            # Horizon cũ chưa có /transactions_async → gửi đồng bộ
+            try:
+                with stage("submit"), upstream("horizon", "submit_transaction"):
+                    return await self.server.submit_transaction(envelope)
+            except Exception as e:
+                record_horizon_error(e)
+                raise
+        except (s_sdk.exceptions.BadRequestError, s_sdk.exceptions.BadResponseError) as e:
+            response = async_submit_response(e)
+            if response is None:
+                record_horizon_error(e)
+                raise
+
+        try:
+            return accepted_transaction(response)
+        except TransactionRejected as e:
+            record_horizon_error(e)
+            raise
+
+    async def _find_transaction(self, tx_hash):
+        try:
+            with upstream("horizon", "transaction"):
+                return await self.server.transactions().transaction(tx_hash).call()
+        except s_sdk.exceptions.NotFoundError:
+            return None
+
+    async def _wait_for_ledger(self, envelope, on_signed=None, timeout=190):
+        # > timeout giao dịch (180s); quá hạn thì payment giữ trạng thái submitting kèm tx_hash để reconcile
+        tx_hash = inner_transaction_hash(envelope)
+        deadline = time.monotonic() + timeout
+        waiter = self.ledger.watch(envelope)
+        try:
+            with stage("confirm"):
+                while True:
+                    remaining = max(0, deadline - time.monotonic())
+                    try:
+                        tx = await asyncio.wait_for(asyncio.shield(waiter), min(self.bump_after, remaining))
+                        break
+                    except asyncio.TimeoutError:
+                        pass
+                    # Stream có thể lỡ giao dịch (đang kết nối lại) → tra trực tiếp trước khi fee-bump
+                    tx = await self._find_transaction(tx_hash)
+                    if tx is not None:
+                        break
+                    if time.monotonic() >= deadline:
+                        raise TimeoutError(f"❌ Giao dịch {tx_hash} chưa lên chain sau {timeout}s")
+                    # Chưa lên chain sau bump_after giây → có thể kẹt vì phí, bọc fee-bump phí cao hơn
+                    try:
+                        bumped = await self._submit_bumped(envelope, on_signed)
+                    except Exception as e:
+                        # Bản cũ vẫn có thể lên chain → tiếp tục chờ
+                        print(f"❌ Fee-bump {tx_hash[:12]}… lỗi: {e}")
+                    else:
+                        if bumped is not None:
+                            envelope = bumped[0]
+                            self.ledger.watch(envelope, waiter)
+        finally:
+            self.ledger.forget(waiter)
+
+        if not tx.get("successful", True):
+            # Fee-bump qua channel: lấy mã của giao dịch bên trong
+            result_codes = decode_result_codes(tx["result_xdr"]) if tx.get("result_xdr") else None
+            raise TransactionRejected("FAILED", "tx_failed", result_codes)
+        return tx["id"]
+
+    # ------------------------------
+    #  A2U Native Test-Pi Payment
+    # ------------------------------
+    async def create_payment(self, payment_data):
+        await self._store("put", payment_data)
+        return payment_data["identifier"]
+
+    async def check_destination(self, destination, asset=None):
+        await asyncio.to_thread(self.destinations.check, destination, asset)
+
+    async def submit_payment(self, payment_id, _):
+        payment = await self._store("get", payment_id)
+
+        try:
+            await self.check_destination(payment["to_address"])
+        except InvalidDestination as e:
+            await self._store("mark", payment_id, "failed", error=str(e))
+            raise
+
+        txid = await self._submit_tracked(
+            payment_id, payment["to_address"], payment["amount"], NATIVE_ASSET, payment["memo"]
+        )
+        await self._store("mark", payment_id, "submitted", txid)
+        return txid
+
+    async def _submit_tracked(self, payment_id, destination, amount, asset, memo=None):
+        """Gửi một payout, lưu tx_hash trước khi submit và đánh dấu failed khi Horizon từ chối."""
+        async def on_signed(tx_hash):
+            await self._store("mark", payment_id, "submitting", extra={"tx_hash": tx_hash})
+
+        try:
+            return await self._submit_payments([(destination, amount, asset)], memo=memo, on_signed=on_signed)
+        except (s_sdk.exceptions.BadRequestError, TransactionRejected) as e:
+            # Horizon từ chối → chắc chắn chưa chuyển tiền
+            await self._store("mark", payment_id, "failed", error=str(e))
+            raise
+
+    async def complete_payment(self, identifier, txid=None):
+        with stage("complete"):
+            result = await self.api.complete_payment(identifier, txid)
+        await self._store("mark", identifier, "completed", txid)
+        return result
+
+    async def approve_payment(self, payment_id):
+        return await self.api.approve_payment(payment_id)
+
+    # ------------------------------
+    #   SEND CUSTOM TOKEN (GMOP)
+    # ------------------------------
+    async def send_token(self, asset_code, asset_issuer, amount, destination):
+        print(f"🚀 Sending {amount} {asset_code} → {destination}")
+
+        asset = shared_asset(asset_code, asset_issuer)
+        await self.check_destination(destination, asset)
+        txid = await self._submit_payments([(destination, amount, asset)])
+
+        print("✅ Token transfer TX:", txid)
+        return txid
+
+    # ------------------------------
+    #  Reconcile payment dở dang (như PiNetwork.reconcile_payments)
+    # ------------------------------
+    async def reconcile_payments(self, idle_seconds=300, lease_seconds=300, resolve_wallet=None):
+        """resolve_wallet(uid): coroutine lấy ví cho job xếp hàng chưa có to_address."""
+        # idle_seconds > timeout giao dịch (180s) → tx chưa thấy trên chain thì sẽ không bao giờ lên
+        for payment in await self._store("stale", idle_seconds):
+            identifier = payment["payment_id"]
+            if not await self._store("claim", identifier, lease_seconds):
+                continue
+            try:
+                await self._reconcile_payment(payment, resolve_wallet)
+            except Exception as e:
+                print(f"❌ Reconcile {identifier} lỗi: {e}")
+
+    async def _reconcile_payment(self, payment, resolve_wallet=None):
+        identifier = payment["payment_id"]
+        txid = payment.get("txid")
+        # Payout lô (/api/a2u-batch): chuyển thẳng trên chain, không có payment Pi để complete
+        transfer = payment.get("kind") == "transfer"
+
+        if not txid and payment.get("tx_hash"):
+            tx = await self._find_transaction(payment["tx_hash"])
+            if tx is not None:
+                if not tx.get("successful", True):
+                    await self._store("mark", identifier, "failed", error="tx_failed")
+                    return
+                txid = tx["id"]
+                await self._store("mark", identifier, "completed" if transfer else "submitted", txid)
+                if transfer:
+                    return
+
+        if transfer:
+            print(f"🔁 Gửi lại payout lô chưa lên chain: {identifier}")
+            asset = shared_asset(payment.get("asset_code"), payment.get("asset_issuer"))
+            txid = await self._submit_tracked(identifier, payment["to_address"], payment["amount"], asset)
+            await self._store("mark", identifier, "completed", txid)
+            return
+
+        if not txid:
+            if not payment.get("to_address"):
+                if not (resolve_wallet and payment.get("user_uid")):
+                    await self._store("mark", identifier, "failed", error="Thiếu địa chỉ ví")
+                    return
+                try:
+                    wallet = await resolve_wallet(payment["user_uid"])
+                except LookupError as e:
+                    await self._store("mark", identifier, "failed", error=str(e))
+                    return
+                await self._store("mark", identifier, payment["status"], extra={"to_address": wallet})
+            print(f"🔁 Gửi lại payment chưa lên chain: {identifier}")
+            txid = await self.submit_payment(identifier, None)
+
+        await self.complete_payment(identifier, txid)
+        print(f"✅ Reconcile xong {identifier}: {txid}")
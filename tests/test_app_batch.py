@@ -0,0 +1,56 @@
+# tests/test_app_batch.py — kiểm tra đầu vào /api/a2u-batch (không cần Horizon / Mongo)
+import os
+
+import pytest
+import stellar_sdk as s_sdk
+
+os.environ.setdefault("APP_PRIVATE_KEY", s_sdk.Keypair.random().secret)
+os.environ.setdefault("PI_API_KEY", "test-key")
+
+import app as app_module  # noqa: E402
+
+WALLET = s_sdk.Keypair.random().public_key
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # Không chạy warm-up / reconcile nền trong test
+    monkeypatch.setattr(app_module, "_background_pid", os.getpid())
+    enqueued = []
+
+    def enqueue_batch(payouts):
+        enqueued.extend(payouts)
+        return [(f"job-{i}", False) for i in range(len(payouts))]
+
+    monkeypatch.setattr(app_module.payout_queue, "enqueue_batch", enqueue_batch)
+    client = app_module.app.test_client()
+    client.enqueued = enqueued
+    return client
+
+
+def post(client, *payouts):
+    return client.post("/api/a2u-batch", json={"payouts": list(payouts)})
+
+
+@pytest.mark.parametrize("amount", [None, "abc", "", "nan", "inf", 0, -5])
+def test_invalid_amount_is_400(client, amount):
+    res = post(client, {"to_wallet": WALLET, "amount": amount})
+    assert res.status_code == 400
+    assert client.enqueued == []
+
+
+@pytest.mark.parametrize("amount", [1, 999, 10001])
+def test_gmop_amount_outside_limit_is_400(client, amount):
+    res = post(client, {"to_wallet": WALLET, "amount": "5000", "asset": "GMOP"},
+               {"to_wallet": WALLET, "amount": amount, "asset": "GMOP"})
+    assert res.status_code == 400
+    assert "GMOP" in res.get_json()["message"]
+    assert client.enqueued == []
+
+
+def test_valid_batch_is_enqueued(client):
+    res = post(client, {"to_wallet": WALLET, "amount": "0.5"},
+               {"to_wallet": WALLET, "amount": 1000, "asset": "gmop", "id": "k1"})
+    assert res.status_code == 202
+    assert [p["asset_code"] for p in client.enqueued] == [None, "GMOP"]
+    assert client.enqueued[1]["key"] == "k1"
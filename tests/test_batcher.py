@@ -0,0 +1,200 @@
+# tests/test_batcher.py — PayoutBatcher: lô có op lỗi chỉ loại op đó, lỗi cấp giao dịch làm hỏng cả lô
+from concurrent.futures import Future
+
+import pytest
+import stellar_sdk as s_sdk
+
+from payment_store import PaymentStore
+from pi_python import NATIVE_ASSET, PayoutBatcher, TransactionRejected
+
+
+class StubNetwork:
+    """Thay PiNetwork: submit lỗi op_no_destination cho ví trong `bad`, hoặc lỗi cấp giao dịch `tx_error`."""
+
+    channels = None
+
+    def __init__(self, bad=(), tx_error=None, ops_in_error=True, fee_bump=False):
+        self.bad = set(bad)
+        self.tx_error = tx_error
+        self.ops_in_error = ops_in_error
+        self.fee_bump = fee_bump
+        self.open_payments = PaymentStore(persist=False)
+        self.submits = []
+
+    def result_codes(self, payments):
+        codes = {"transaction": "tx_failed"}
+        if self.ops_in_error:
+            codes["operations"] = ["op_no_destination" if d in self.bad else "op_success" for d, _, _ in payments]
+        if self.fee_bump:
+            # Channel: giao dịch là fee-bump, Horizon bọc mã thật trong inner_transaction
+            codes["inner_transaction"] = codes["transaction"]
+            codes["transaction"] = "tx_fee_bump_inner_failed"
+        return codes
+
+    def _submit_payments(self, payments, memo=None, on_signed=None):
+        self.submits.append([destination for destination, _, _ in payments])
+        if self.tx_error:
+            codes = {"transaction": self.tx_error}
+            if self.fee_bump:
+                codes = {"transaction": "tx_fee_bump_inner_failed", "inner_transaction": self.tx_error}
+            raise TransactionRejected("ERROR", result_codes=codes)
+        if self.bad & {destination for destination, _, _ in payments}:
+            raise TransactionRejected("ERROR", result_codes=self.result_codes(payments))
+        return f"tx-{len(self.submits)}"
+
+
+def items(destinations):
+    return [(destination, "1", NATIVE_ASSET, None, Future()) for destination in destinations]
+
+
+def outcome(batch):
+    return ["ok" if item[4].exception() is None else "failed" for item in batch]
+
+
+def test_failed_op_is_dropped_and_rest_resent():
+    pi = StubNetwork(bad={"b"})
+    batch = items(["a", "b", "c", "d"])
+    PayoutBatcher(pi)._send(batch)
+    assert pi.submits == [["a", "b", "c", "d"], ["a", "c", "d"]]
+    assert outcome(batch) == ["ok", "failed", "ok", "ok"]
+    assert "op_no_destination" in str(batch[1][4].exception())
+
+
+def test_without_op_codes_batch_is_halved():
+    pi = StubNetwork(bad={"d"}, ops_in_error=False)
+    batch = items(["a", "b", "c", "d"])
+    PayoutBatcher(pi)._send(batch)
+    assert pi.submits == [["a", "b", "c", "d"], ["a", "b"], ["c", "d"], ["c"], ["d"]]
+    assert outcome(batch) == ["ok", "ok", "ok", "failed"]
+
+
+@pytest.mark.parametrize("code", ["tx_insufficient_balance", "tx_bad_auth"])
+def test_transaction_level_error_fails_whole_batch(code):
+    pi = StubNetwork(tx_error=code)
+    batch = items(["a", "b", "c"])
+    PayoutBatcher(pi)._send(batch)
+    assert len(pi.submits) == 1
+    assert outcome(batch) == ["failed"] * 3
+
+
+class RecordingStore(PaymentStore):
+    def __init__(self):
+        super().__init__(persist=False)
+        self.marks = []
+
+    def mark(self, identifier, status, txid=None, error=None, extra=None):
+        self.marks.append((identifier, status))
+        super().mark(identifier, status, txid, error, extra)
+
+    def mark_many(self, identifiers, status, txid=None, error=None, extra=None):
+        self.marks.extend((identifier, status) for identifier in identifiers)
+        super().mark_many(identifiers, status, txid, error, extra)
+
+
+def test_failed_payouts_are_marked_in_store():
+    pi = StubNetwork(bad={"b"})
+    pi.open_payments = RecordingStore()
+    batch = [("a", "1", NATIVE_ASSET, "p-a", Future()), ("b", "1", NATIVE_ASSET, "p-b", Future())]
+    PayoutBatcher(pi)._send(batch)
+    assert ("p-b", "failed") in pi.open_payments.marks
+    assert ("p-a", "completed") in pi.open_payments.marks
+    assert ("p-b", "completed") not in pi.open_payments.marks
+
+
+def test_channel_fee_bump_failed_op_is_dropped():
+    pi = StubNetwork(bad={"c"}, fee_bump=True)
+    batch = items(["a", "b", "c", "d"])
+    PayoutBatcher(pi)._send(batch)
+    assert pi.submits == [["a", "b", "c", "d"], ["a", "b", "d"]]
+    assert outcome(batch) == ["ok", "ok", "failed", "ok"]
+
+
+def test_channel_fee_bump_horizon_error_is_split():
+    # Submit đồng bộ: Horizon trả BadRequestError với result_codes của fee-bump
+    class HorizonStub(StubNetwork):
+        def _submit_payments(self, payments, memo=None, on_signed=None):
+            try:
+                return super()._submit_payments(payments, memo, on_signed)
+            except TransactionRejected as e:
+                error = s_sdk.exceptions.BadRequestError.__new__(s_sdk.exceptions.BadRequestError)
+                error.extras = e.extras
+                raise error
+
+    pi = HorizonStub(bad={"a"}, fee_bump=True)
+    batch = items(["a", "b", "c", "d"])
+    PayoutBatcher(pi)._send(batch)
+    assert len(pi.submits) == 2
+    assert outcome(batch) == ["failed", "ok", "ok", "ok"]
+
+
+def test_channel_transaction_level_error_fails_whole_batch():
+    pi = StubNetwork(tx_error="tx_insufficient_balance", fee_bump=True)
+    batch = items(["a", "b"])
+    PayoutBatcher(pi)._send(batch)
+    assert len(pi.submits) == 1
+    assert outcome(batch) == ["failed", "failed"]
+
+
+def test_store_error_still_resolves_futures():
+    class BrokenStore(PaymentStore):
+        def mark(self, *args, **kwargs):
+            raise RuntimeError("mongo down")
+
+        def mark_many(self, *args, **kwargs):
+            raise RuntimeError("mongo down")
+
+    pi = StubNetwork(bad={"b"})
+    pi.open_payments = BrokenStore(persist=False)
+    batch = [("a", "1", NATIVE_ASSET, "p-a", Future()), ("b", "1", NATIVE_ASSET, "p-b", Future())]
+    PayoutBatcher(pi)._send(batch)
+    assert all(item[4].done() for item in batch)
+    assert outcome(batch) == ["ok", "failed"]
+
+
+def test_send_batch_times_out_instead_of_blocking():
+    from pi_python import PiNetwork
+
+    class StuckBatcher:
+        def submit(self, destination, amount, asset, payment_id=None):
+            return Future()  # không bao giờ xong
+
+    pi = PiNetwork()
+    pi.batcher = StuckBatcher()
+    results = pi.send_batch([{"destination": "a", "amount": "1", "asset": NATIVE_ASSET}], timeout=0.1)
+    assert results[0]["success"] is False
+    assert "reconcile" in results[0]["message"]
+
+
+def test_channel_batch_stores_inner_hash():
+    # Hash ngoài đổi mỗi lần fee-bump lại → store phải giữ hash bên trong để reconcile tra được
+    source, channel = s_sdk.Keypair.random(), s_sdk.Keypair.random()
+    inner = (
+        s_sdk.TransactionBuilder(s_sdk.Account(source.public_key, 1), s_sdk.Network.TESTNET_NETWORK_PASSPHRASE, 100)
+        .append_payment_op(s_sdk.Keypair.random().public_key, s_sdk.Asset.native(), "1")
+        .set_timeout(30)
+        .build()
+    )
+    inner.sign(source)
+    envelope = s_sdk.TransactionBuilder.build_fee_bump_transaction(
+        channel, 200, inner, s_sdk.Network.TESTNET_NETWORK_PASSPHRASE
+    )
+
+    class SigningStub(StubNetwork):
+        def _submit_payments(self, payments, memo=None, on_signed=None):
+            on_signed(envelope)
+            return super()._submit_payments(payments, memo, on_signed)
+
+    pi = SigningStub()
+    pi.open_payments = RecordingStore()
+    pi.open_payments.mark("p-a", "queued")
+    seen = {}
+    original = pi.open_payments.mark_many
+
+    def mark_many(identifiers, status, txid=None, error=None, extra=None):
+        if status == "submitting":
+            seen.update(extra)
+        original(identifiers, status, txid, error, extra)
+
+    pi.open_payments.mark_many = mark_many
+    PayoutBatcher(pi)._send([("a", "1", NATIVE_ASSET, "p-a", Future())])
+    assert seen["tx_hash"] == inner.hash_hex() != envelope.hash_hex()
@@ -0,0 +1,94 @@
+# tests/test_cache.py — TTLCache: gộp các lần miss đồng thời, cache lỗi ngắn hạn
+import asyncio
+import threading
+import time
+
+import pytest
+
+from cache import TTLCache
+
+
+class Missing(Exception):
+    pass
+
+
+def test_concurrent_misses_call_loader_once():
+    cache = TTLCache(ttl=60)
+    calls = []
+    barrier = threading.Barrier(10)
+    results = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.1)
+        return "value"
+
+    def worker():
+        barrier.wait()
+        results.append(cache.get_or_load("key", loader))
+
+    threads = [threading.Thread(target=worker) for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert results == ["value"] * 10
+
+
+def test_cached_error_until_negative_ttl():
+    cache = TTLCache(ttl=60, negative_ttl=0.1, cache_error=lambda e: isinstance(e, Missing))
+    calls = []
+
+    def loader():
+        calls.append(1)
+        raise Missing()
+
+    for _ in range(3):
+        with pytest.raises(Missing):
+            cache.get_or_load("key", loader)
+    assert len(calls) == 1
+    time.sleep(0.15)
+    with pytest.raises(Missing):
+        cache.get_or_load("key", loader)
+    assert len(calls) == 2
+
+
+def test_uncached_error_retries_and_releases_waiters():
+    cache = TTLCache(ttl=60)
+    calls = []
+
+    def loader():
+        calls.append(1)
+        raise RuntimeError("upstream down")
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_load("key", loader)
+    with pytest.raises(RuntimeError):
+        cache.get_or_load("key", loader)
+    assert len(calls) == 2
+    assert cache.get_or_load("key", lambda: "ok") == "ok"
+
+
+def test_expired_entry_reloads():
+    cache = TTLCache(ttl=0.05)
+    assert cache.get_or_load("key", lambda: 1) == 1
+    assert cache.get_or_load("key", lambda: 2) == 1
+    time.sleep(0.06)
+    assert cache.get_or_load("key", lambda: 3) == 3
+
+
+def test_async_concurrent_misses_call_loader_once():
+    cache = TTLCache(ttl=60)
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "value"
+
+    async def main():
+        return await asyncio.gather(*(cache.get_or_load_async("key", loader) for _ in range(20)))
+
+    assert asyncio.run(main()) == ["value"] * 20
+    assert len(calls) == 1
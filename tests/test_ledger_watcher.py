@@ -0,0 +1,111 @@
+# tests/test_ledger_watcher.py — AsyncPiNetwork chờ ledger qua một stream chung, tra trực tiếp khi stream lỡ
+import asyncio
+
+import stellar_sdk as s_sdk
+
+from payment_store import PaymentStore
+from pi_python import inner_transaction_hash
+from pi_python_async import AsyncLedgerWatcher, AsyncPiNetwork
+
+
+def signed_envelope(fee_bump=False):
+    source = s_sdk.Keypair.random()
+    envelope = (
+        s_sdk.TransactionBuilder(s_sdk.Account(source.public_key, 1), s_sdk.Network.TESTNET_NETWORK_PASSPHRASE, 100)
+        .append_payment_op(s_sdk.Keypair.random().public_key, s_sdk.Asset.native(), "1")
+        .set_timeout(30)
+        .build()
+    )
+    envelope.sign(source)
+    if fee_bump:
+        channel = s_sdk.Keypair.random()
+        envelope = s_sdk.TransactionBuilder.build_fee_bump_transaction(
+            channel, 200, envelope, s_sdk.Network.TESTNET_NETWORK_PASSPHRASE
+        )
+    return envelope
+
+
+class IdleWatcher(AsyncLedgerWatcher):
+    """Không mở stream thật, giao dịch được đẩy vào bằng _match."""
+
+    def start(self):
+        pass
+
+
+class LookupServer:
+    def __init__(self, records):
+        self.records = records
+        self.lookups = []
+
+    def transactions(self):
+        return self
+
+    def transaction(self, tx_hash):
+        self.lookups.append(tx_hash)
+        self._hash = tx_hash
+        return self
+
+    async def call(self):
+        if self._hash not in self.records:
+            raise s_sdk.exceptions.NotFoundError.__new__(s_sdk.exceptions.NotFoundError)
+        return self.records[self._hash]
+
+
+def test_stream_match_by_inner_hash_wakes_waiter():
+    async def run():
+        watcher = IdleWatcher(None, "app")
+        envelope = signed_envelope(fee_bump=True)
+        waiter = watcher.watch(envelope)
+        inner_hash = inner_transaction_hash(envelope)
+        watcher._match({"hash": "other", "inner_transaction": {"hash": inner_hash}, "id": "tx-1"})
+        assert (await waiter)["id"] == "tx-1"
+        watcher.forget(waiter)
+        assert watcher._waiters == {} and watcher._watched == {}
+
+    asyncio.run(run())
+
+
+def test_wait_for_ledger_looks_up_when_stream_misses():
+    async def run():
+        envelope = signed_envelope()
+        pi = AsyncPiNetwork()
+        pi.server = LookupServer({envelope.hash_hex(): {"id": envelope.hash_hex(), "successful": True}})
+        pi.ledger = IdleWatcher(pi.server, "app")
+        pi.bump_after = 0.01
+        assert await pi._wait_for_ledger(envelope) == envelope.hash_hex()
+        assert pi.server.lookups == [envelope.hash_hex()]
+        assert pi.ledger._waiters == {}
+
+    asyncio.run(run())
+
+
+def test_memory_store_is_bounded():
+    store = PaymentStore(persist=False, maxsize=2)
+    for identifier in ("a", "b", "c"):
+        store.put({"identifier": identifier})
+    assert len(store) == 2
+    assert list(store._payments) == ["b", "c"]
+
+
+def test_reconcile_completes_transfer_found_on_chain():
+    class StaleStore(PaymentStore):
+        def __init__(self, payments):
+            super().__init__(persist=False)
+            self.payments = payments
+            self.marks = []
+
+        def stale(self, idle_seconds):
+            return self.payments
+
+        def mark(self, identifier, status, txid=None, error=None, extra=None):
+            self.marks.append((identifier, status, txid))
+
+    async def run():
+        pi = AsyncPiNetwork()
+        pi.open_payments = StaleStore([{"payment_id": "p-1", "kind": "transfer", "tx_hash": "h-1",
+                                        "status": "submitting"}])
+        pi.server = LookupServer({"h-1": {"id": "tx-1", "successful": True}})
+        await pi.reconcile_payments()
+        assert pi.open_payments.marks == [("p-1", "completed", "tx-1")]
+
+    asyncio.run(run())
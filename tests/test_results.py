@@ -0,0 +1,152 @@
+# tests/test_results.py — giải mã kết quả /transactions_async và mã lỗi Horizon (kể cả fee-bump qua channel)
+import json
+from contextlib import nullcontext
+
+import pytest
+import stellar_sdk as s_sdk
+from stellar_sdk import xdr
+
+from pi_python import (
+    PiNetwork, TransactionRejected, accepted_transaction, async_submit_response,
+    inner_transaction_hash, operation_result_codes, transaction_result_code
+)
+
+
+def payment_result(code):
+    return xdr.OperationResult(
+        xdr.OperationResultCode.opINNER,
+        xdr.OperationResultTr(xdr.OperationType.PAYMENT, payment_result=xdr.PaymentResult(code))
+    )
+
+
+def result_xdr(code, results=None):
+    return xdr.TransactionResult(
+        xdr.Int64(0), xdr.TransactionResultResult(code, results=results), xdr.TransactionResultExt(0)
+    ).to_xdr()
+
+
+def fee_bump_result_xdr(inner_code, results=None):
+    inner = xdr.InnerTransactionResult(
+        xdr.Int64(0), xdr.InnerTransactionResultResult(inner_code, results), xdr.InnerTransactionResultExt(0)
+    )
+    pair = xdr.InnerTransactionResultPair(xdr.Hash(bytes(32)), inner)
+    return xdr.TransactionResult(
+        xdr.Int64(0),
+        xdr.TransactionResultResult(xdr.TransactionResultCode.txFEE_BUMP_INNER_FAILED, inner_result_pair=pair),
+        xdr.TransactionResultExt(0)
+    ).to_xdr()
+
+
+@pytest.mark.parametrize("tx_status", ["PENDING", "DUPLICATE"])
+def test_accepted(tx_status):
+    assert accepted_transaction({"tx_status": tx_status, "hash": "abc"}) == {"id": "abc", "pending": True}
+
+
+def test_rejected_bad_seq():
+    with pytest.raises(TransactionRejected) as info:
+        accepted_transaction({"tx_status": "ERROR", "error_result_xdr": result_xdr(xdr.TransactionResultCode.txBAD_SEQ)})
+    assert transaction_result_code(info.value) == "tx_bad_seq"
+
+
+def test_rejected_op_codes():
+    results = [payment_result(xdr.PaymentResultCode.PAYMENT_SUCCESS),
+               payment_result(xdr.PaymentResultCode.PAYMENT_NO_DESTINATION)]
+    with pytest.raises(TransactionRejected) as info:
+        accepted_transaction({"tx_status": "ERROR",
+                              "error_result_xdr": result_xdr(xdr.TransactionResultCode.txFAILED, results)})
+    assert transaction_result_code(info.value) == "tx_failed"
+    assert operation_result_codes(info.value) == ["op_success", "op_no_destination"]
+
+
+def test_rejected_fee_bump_unwraps_inner_result():
+    results = [payment_result(xdr.PaymentResultCode.PAYMENT_UNDERFUNDED)]
+    with pytest.raises(TransactionRejected) as info:
+        accepted_transaction({"tx_status": "ERROR",
+                              "error_result_xdr": fee_bump_result_xdr(xdr.TransactionResultCode.txFAILED, results)})
+    codes = info.value.extras["result_codes"]
+    assert codes["transaction"] == "tx_fee_bump_inner_failed"
+    assert transaction_result_code(info.value) == "tx_failed"
+    assert operation_result_codes(info.value) == ["op_underfunded"]
+
+
+def test_fee_bump_inner_bad_seq_is_retryable_code():
+    with pytest.raises(TransactionRejected) as info:
+        accepted_transaction({"tx_status": "ERROR",
+                              "error_result_xdr": fee_bump_result_xdr(xdr.TransactionResultCode.txBAD_SEQ)})
+    assert transaction_result_code(info.value) == "tx_bad_seq"
+
+
+def test_try_again_later_without_xdr():
+    with pytest.raises(TransactionRejected) as info:
+        accepted_transaction({"tx_status": "TRY_AGAIN_LATER", "hash": "abc"})
+    assert transaction_result_code(info.value) == "try_again_later"
+
+
+def test_horizon_fee_bump_extras():
+    error = s_sdk.exceptions.BadRequestError.__new__(s_sdk.exceptions.BadRequestError)
+    error.extras = {"result_codes": {"transaction": "tx_fee_bump_inner_failed",
+                                     "inner_transaction": "tx_failed",
+                                     "operations": ["op_success", "op_no_trust"]}}
+    assert transaction_result_code(error) == "tx_failed"
+    assert operation_result_codes(error) == ["op_success", "op_no_trust"]
+
+
+def test_async_submit_response():
+    error = s_sdk.exceptions.BadResponseError.__new__(s_sdk.exceptions.BadResponseError)
+    error.message = json.dumps({"tx_status": "TRY_AGAIN_LATER", "hash": "abc"})
+    assert async_submit_response(error)["tx_status"] == "TRY_AGAIN_LATER"
+    error.message = "<html>Bad gateway</html>"
+    assert async_submit_response(error) is None
+
+
+class FixedSequence:
+    def __init__(self, public_key):
+        self.public_key = public_key
+        self.invalidated = False
+
+    def hold(self):
+        return nullcontext()
+
+    def reserve(self):
+        return s_sdk.Account(self.public_key, 1)
+
+    def invalidate(self):
+        self.invalidated = True
+
+
+class FixedFees:
+    def current(self):
+        return 100
+
+    def bump_fee(self, previous_fee):
+        return previous_fee * 10
+
+
+def test_async_insufficient_fee_is_fee_bumped():
+    # /transactions_async từ chối tx_insufficient_fee → bọc fee-bump ngay, không đánh dấu failed
+    class Server:
+        def __init__(self):
+            self.submitted = []
+
+        def submit_transaction_async(self, envelope):
+            self.submitted.append(envelope)
+            if len(self.submitted) == 1:
+                return {"tx_status": "ERROR", "hash": envelope.hash_hex(),
+                        "error_result_xdr": result_xdr(xdr.TransactionResultCode.txINSUFFICIENT_FEE)}
+            return {"tx_status": "PENDING", "hash": envelope.hash_hex()}
+
+    pi = PiNetwork()
+    pi.keypair = s_sdk.Keypair.random()
+    pi.network = s_sdk.Network.TESTNET_NETWORK_PASSPHRASE
+    pi.server = Server()
+    pi.fee_oracle = FixedFees()
+    pi.sequence = FixedSequence(pi.keypair.public_key)
+    signed = []
+
+    txid = pi._submit_once([(s_sdk.Keypair.random().public_key, "1", s_sdk.Asset.native())],
+                           on_signed=signed.append, wait=False)
+    original, bumped = pi.server.submitted
+    assert isinstance(bumped, s_sdk.FeeBumpTransactionEnvelope)
+    assert txid == bumped.hash_hex()
+    assert [inner_transaction_hash(envelope) for envelope in signed] == [original.hash_hex()] * 2
+    assert not pi.sequence.invalidated
@@ -0,0 +1,136 @@
+# tests/test_sequence.py — SequenceManager / ChannelPool: cấp sequence qua file lock, dùng chung giữa các process
+import fcntl
+import multiprocessing
+import threading
+
+import pytest
+import stellar_sdk as s_sdk
+
+from pi_python import AccountBusy, ChannelPool, SequenceManager
+
+START = 1000
+
+
+class FakeServer:
+    def __init__(self, sequence=START):
+        self.sequence = sequence
+        self.loads = 0
+
+    def load_account(self, account_id):
+        self.loads += 1
+        return s_sdk.Account(account_id, self.sequence)
+
+
+def reserve_many(lock_dir, account_id, count, queue):
+    manager = SequenceManager(FakeServer(), account_id, str(lock_dir))
+    sequences = []
+    for _ in range(count):
+        with manager.hold():
+            sequences.append(manager.reserve().sequence)
+    queue.put(sequences)
+
+
+def test_reserve_continues_from_lock_file(tmp_path):
+    account_id = s_sdk.Keypair.random().public_key
+    server = FakeServer()
+    first = SequenceManager(server, account_id, str(tmp_path))
+    with first.hold():
+        assert first.reserve().sequence == START
+        assert first.reserve().sequence == START + 1
+
+    # Worker khác (instance khác) đọc sequence đã cấp từ file, không load lại Horizon
+    other = SequenceManager(server, account_id, str(tmp_path))
+    with other.hold():
+        assert other.reserve().sequence == START + 2
+    assert server.loads == 1
+
+
+def test_invalidate_reloads_from_horizon(tmp_path):
+    account_id = s_sdk.Keypair.random().public_key
+    server = FakeServer()
+    manager = SequenceManager(server, account_id, str(tmp_path))
+    with manager.hold():
+        manager.reserve()
+        manager.invalidate()
+    server.sequence = START + 5
+    with manager.hold():
+        assert manager.reserve().sequence == START + 5
+    assert server.loads == 2
+
+
+def test_prime_keeps_reserved_sequence(tmp_path):
+    account_id = s_sdk.Keypair.random().public_key
+    manager = SequenceManager(FakeServer(), account_id, str(tmp_path))
+    with manager.hold():
+        manager.reserve()
+        manager.reserve()
+    manager.prime(s_sdk.Account(account_id, START))
+    with manager.hold():
+        assert manager.reserve().sequence == START + 2
+
+
+def test_threads_get_unique_sequences(tmp_path):
+    account_id = s_sdk.Keypair.random().public_key
+    manager = SequenceManager(FakeServer(), account_id, str(tmp_path))
+    sequences = []
+
+    def worker():
+        for _ in range(50):
+            with manager.hold():
+                sequences.append(manager.reserve().sequence)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(sequences) == list(range(START, START + 400))
+
+
+def test_processes_get_unique_sequences(tmp_path):
+    account_id = s_sdk.Keypair.random().public_key
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    processes = [context.Process(target=reserve_many, args=(tmp_path, account_id, 50, queue)) for _ in range(4)]
+    for p in processes:
+        p.start()
+    sequences = [s for _ in processes for s in queue.get(timeout=30)]
+    for p in processes:
+        p.join(timeout=30)
+    assert sorted(sequences) == list(range(START, START + 200))
+
+
+def test_hold_non_blocking_raises_when_other_process_holds(tmp_path):
+    account_id = s_sdk.Keypair.random().public_key
+    manager = SequenceManager(FakeServer(), account_id, str(tmp_path))
+    with open(manager.path, "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        with pytest.raises(AccountBusy):
+            with manager.hold(blocking=False):
+                pass
+    with manager.hold(blocking=False):
+        pass
+
+
+def test_channel_pool_skips_busy_channels(tmp_path):
+    secrets = [s_sdk.Keypair.random().secret for _ in range(2)]
+    pool = ChannelPool(FakeServer(), secrets, str(tmp_path))
+    with pool.acquire() as first:
+        # Trong cùng process: channel đang giữ bị bỏ qua
+        with pool.acquire(timeout=1) as second:
+            assert second.keypair.public_key != first.keypair.public_key
+            with pytest.raises(TimeoutError):
+                with pool.acquire(timeout=0.1):
+                    pass
+
+
+def test_channel_pool_skips_channel_locked_by_other_worker(tmp_path):
+    secrets = [s_sdk.Keypair.random().secret for _ in range(2)]
+    pool = ChannelPool(FakeServer(), secrets, str(tmp_path))
+    # Worker khác giữ channel đầu tiên qua file lock
+    busy = SequenceManager(FakeServer(), s_sdk.Keypair.from_secret(secrets[0]).public_key, str(tmp_path))
+    with open(busy.path, "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        for _ in range(3):
+            with pool.acquire(timeout=1) as channel:
+                assert channel.keypair.secret == secrets[1]
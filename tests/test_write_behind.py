@@ -0,0 +1,85 @@
+# tests/test_write_behind.py — WriteBehindBuffer: op chưa ghi được xếp lại, không mất khi Mongo lỗi
+import os
+
+from pymongo import UpdateOne
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from db import WriteBehindBuffer
+
+
+class FakeCollection:
+    def __init__(self):
+        self.written = []
+        self.fail = []  # exception cho từng lần bulk_write kế tiếp
+
+    def bulk_write(self, ops, ordered=True):
+        if self.fail:
+            error = self.fail.pop(0)
+            if isinstance(error, BulkWriteError):
+                # ordered=True: các op trước op lỗi đã được ghi
+                index = error.details["writeErrors"][0]["index"] if error.details["writeErrors"] else len(ops)
+                self.written.extend(ops[:index])
+            raise error
+        self.written.extend(ops)
+
+
+def op(i):
+    return UpdateOne({"payment_id": str(i)}, {"$set": {"n": i}})
+
+
+def buffer_with(collection, count):
+    buffer = WriteBehindBuffer(collection, max_ops=1000, interval=60)
+    buffer._ops = [op(i) for i in range(count)]
+    return buffer
+
+
+def test_connection_error_requeues_all_ops():
+    collection = FakeCollection()
+    collection.fail = [AutoReconnect("down")]
+    buffer = buffer_with(collection, 3)
+    assert buffer.flush() is False
+    assert len(buffer._ops) == 3
+    assert buffer.flush() is True
+    assert collection.written == [op(i) for i in range(3)]
+
+
+def test_write_error_drops_only_failing_op():
+    collection = FakeCollection()
+    collection.fail = [BulkWriteError({"writeErrors": [{"index": 1, "errmsg": "dup"}], "nInserted": 0})]
+    buffer = buffer_with(collection, 4)
+    assert buffer.flush() is False
+    assert buffer._ops == [op(2), op(3)]
+    assert buffer.flush() is True
+    assert collection.written == [op(0), op(2), op(3)]
+
+
+def test_requeued_ops_stay_before_new_ops():
+    collection = FakeCollection()
+    collection.fail = [AutoReconnect("down")]
+    buffer = buffer_with(collection, 2)
+    buffer.flush()
+    buffer._ops.append(op(9))
+    buffer.flush()
+    assert collection.written == [op(0), op(1), op(9)]
+
+
+def test_write_concern_error_requeues_all_ops():
+    collection = FakeCollection()
+    collection.fail = [BulkWriteError({"writeErrors": [], "writeConcernErrors": [{"errmsg": "timeout"}]})]
+    buffer = buffer_with(collection, 3)
+    assert buffer.flush() is False
+    assert buffer._ops == [op(i) for i in range(3)]
+    assert buffer.flush() is True
+
+
+def test_pending_keys_follow_unflushed_ops():
+    collection = FakeCollection()
+    collection.fail = [AutoReconnect("down")]
+    buffer = WriteBehindBuffer(collection, max_ops=1000, interval=60)
+    buffer._pid = os.getpid()  # không khởi động thread nền
+    buffer.add(op(1), keys=["1"])
+    assert buffer.pending("1") and not buffer.pending("2")
+    buffer.flush()
+    assert buffer.pending("1")
+    buffer.flush()
+    assert not buffer.pending("1")